@@ -0,0 +1,82 @@
+import time
+import threading
+from datetime import datetime
+from scan_service import TZ, MARKET_OPEN, MARKET_CLOSE, _at
+
+# --- 全站停損/停利監控：每輪把所有人的持股與自選合成「不重複代碼」只抓一次 ---
+# 抓取量隨不重複代碼數成長，不隨使用者數 x 持股數成長；觸發的警示寫入 alerts 表，下次登入時顯示。
+# 「觸發中」的狀態也存在 alerts 表 (不放記憶體)：重啟或多個副本各跑一份監控都不會重複通知
+
+
+def check_position(p, q):
+    # 預設值與模擬倉頁面相同：沒設停損用 max(20MA, 60MA)，沒設停利用成本 1.2 倍
+    sl, tp = p.get("stop_loss"), p.get("take_profit")
+    if sl is None: sl = max(q["ma20"], q["ma60"])
+    if tp is None: tp = p["c"] / (p["q"] * 1000) * 1.2
+    if q["close"] <= sl: return "stop", sl
+    if q["close"] >= tp: return "target", tp
+    return None, None
+
+
+class AlertService:
+    def __init__(self, repo, quotes, interval_sec=300, market_hours_only=True):
+        self.repo = repo
+        self.quotes = quotes          # 與模擬倉/自選頁共用同一個 QuoteService 快取
+        self.interval_sec = interval_sec
+        self.market_hours_only = market_hours_only
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {}
+
+    def stats(self):
+        with self._lock: return dict(self._stats)
+
+    def due(self, now=None):
+        if not self.market_hours_only: return True
+        now = now or datetime.now(TZ)
+        return now.weekday() < 5 and _at(now, MARKET_OPEN) <= now <= _at(now, MARKET_CLOSE)
+
+    def run_once(self):
+        t0 = time.perf_counter()
+        positions = [p for p in self.repo.all_positions() if p.get("q")]
+        watchlists = self.repo.all_watchlists()
+        tickers = sorted({p["ticker"] for p in positions} | {t for wl in watchlists.values() for t in wl})
+        quotes = self.quotes.get(tickers, sync=True) if tickers else {}
+        open_keys = self.repo.open_alert_keys()  # 仍在觸發中的 (使用者, 代碼, 類型)，條件解除前不重複通知
+        stamp = datetime.now(TZ).strftime("%Y-%m-%d %H:%M")
+        rows, active, unknown = [], set(), set()
+        for p in positions:
+            q = quotes.get(p["ticker"])
+            if not q:
+                unknown.add((p["username"], p["ticker"]))  # 沒有報價就無法判斷是否解除，維持原狀
+                continue
+            kind, level = check_position(p, q)
+            if kind is None: continue
+            key = (p["username"], p["ticker"], kind)
+            active.add(key)
+            if key in open_keys: continue
+            rows.append({"username": p["username"], "ticker": p["ticker"], "kind": kind,
+                         "price": q["close"], "level": float(level), "created_at": stamp})
+        if rows: self.repo.insert_alerts(rows)
+        cleared = {k for k in open_keys - active if k[:2] not in unknown}
+        if cleared: self.repo.clear_alerts(cleared)
+        with self._lock:
+            self._stats = {"last_run": stamp, "seconds": round(time.perf_counter() - t0, 3),
+                           "users": len({p["username"] for p in positions} | set(watchlists)),
+                           "positions": len(positions), "tickers": len(tickers), "quoted": len(quotes),
+                           "new_alerts": len(rows), "active": len(active), "cleared": len(cleared)}
+        return rows
+
+    def start(self):
+        # 整個 process 只啟動一次；單輪出錯記下來給管理頁看，不讓執行緒結束
+        if self._thread is not None: return self
+        def loop():
+            while True:
+                try:
+                    if self.due(): self.run_once()
+                except Exception as e:
+                    with self._lock: self._stats = {**self._stats, "error": f"{type(e).__name__}: {e}"}
+                time.sleep(self.interval_sec)
+        self._thread = threading.Thread(target=loop, name="alert-monitor", daemon=True)
+        self._thread.start()
+        return self
@@ -0,0 +1,122 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from market_data import FIELDS
+from price_store import PriceStore
+from strategies import load_strategies, with_derived, evaluate, DEFAULT_STRATEGY
+
+# --- 歷史回測：用與雷達相同的策略條件重播多年日線，模擬停損/停利出場 ---
+# 完全離線：讀取 PriceStore 格式的資料夾 (meta.json + ohlcv-*.npy)
+# 先用 `python backtest.py --build --years 5` 建好資料夾後，之後都不需連網
+
+
+def indicator_frame(df):
+    # 每個交易日都算一次與 screener.compute_indicators 同名的指標 (逐日向量化)
+    c, v = df['Close'], df['Volume']
+    ma60 = c.rolling(60).mean()
+    wk = c.resample('W').last()
+    pos = wk.index.searchsorted(c.index)
+    prior19 = wk.shift(1).rolling(19).sum().to_numpy()[pos]  # 當週以前 19 個完整週
+    return pd.DataFrame({
+        'bars': np.arange(1, len(c) + 1), 'close': c, 'prev_close': c.shift(1), 'volume': v,
+        'ma5': c.rolling(5).mean(), 'ma10': c.rolling(10).mean(), 'ma20': c.rolling(20).mean(),
+        'ma60': ma60, 'ma60_prev': ma60.shift(1), 'v20_avg': v.rolling(20).mean(),
+        'w_ma20': (prior19 + c.to_numpy()) / 20, 'day_ret': (c - c.shift(1)) / c.shift(1),
+    }, index=c.index)
+
+
+def simulate(ticker, df, signal, stop, target, max_hold, start):
+    # 同一檔同時只持有一筆；進場價為訊號日收盤，之後逐日檢查最低價/最高價
+    o, h, l, c = (df[f].to_numpy() for f in ['Open', 'High', 'Low', 'Close'])
+    dates = df.index
+    trades, n = [], len(df)
+    entries = np.flatnonzero(signal.to_numpy() & (dates >= start))
+    for i in entries:
+        if trades and dates[i] <= trades[-1]['exit_date']: continue
+        sl, tp, entry = stop.iloc[i], target.iloc[i], c[i]
+        end = min(i + max_hold, n - 1)
+        exit_i, px, reason = end, c[end], "time"
+        for j in range(i + 1, end + 1):
+            if l[j] <= sl:
+                exit_i, px, reason = j, min(o[j], sl), "stop"; break
+            if h[j] >= tp:
+                exit_i, px, reason = j, max(o[j], tp), "target"; break
+        if exit_i == i: continue  # 最後一天的訊號沒有後續資料
+        trades.append({"ticker": ticker, "entry_date": dates[i], "entry": entry, "exit_date": dates[exit_i],
+                       "exit": px, "reason": reason, "days": exit_i - i, "ret": px / entry - 1})
+    return trades
+
+
+def run_shard(args):
+    data_dir, tickers, strategy, max_hold, start = args
+    panels = PriceStore(root=data_dir).load(columns=tickers)
+    strategies = {strategy["name"]: strategy}
+    trades = []
+    for t in tickers:
+        df = pd.DataFrame({f: panels[f][t] for f in FIELDS}).dropna()
+        if len(df) < 2: continue
+        ind = with_derived(indicator_frame(df), strategies)
+        signal = evaluate(ind, strategies)[strategy["name"]]
+        stop = ind.eval(strategy.get("stop", "ma20"), engine="python")
+        target = ind.eval(strategy.get("target", "close * 1.2"), engine="python")
+        trades += simulate(t, df, signal, stop, target, max_hold, start)
+    return trades
+
+
+def summarize(trades):
+    if trades.empty: return {"trades": 0}
+    curve = trades.sort_values('exit_date')['ret'].cumsum()
+    return {
+        "trades": len(trades),
+        "hit_rate": (trades['reason'] == 'target').mean(),
+        "stop_rate": (trades['reason'] == 'stop').mean(),
+        "win_rate": (trades['ret'] > 0).mean(),
+        "avg_ret": trades['ret'].mean(),
+        "median_ret": trades['ret'].median(),
+        "avg_days": trades['days'].mean(),
+        "max_drawdown": (curve - curve.cummax()).min(),  # 每筆等額投入、報酬累加的最大回落
+    }
+
+
+def backtest(data_dir, tickers=None, strategy=DEFAULT_STRATEGY, years=5, max_hold=60, workers=None, shard_size=50):
+    cols = PriceStore(root=data_dir).meta().get("tickers", [])
+    have = set(cols)
+    tickers = [t for t in (tickers or cols) if t in have]
+    strat = {"name": strategy, **load_strategies()[strategy]}
+    start = pd.Timestamp.today().normalize() - pd.DateOffset(years=years)
+    shards = [(data_dir, tickers[i : i + shard_size], strat, max_hold, start) for i in range(0, len(tickers), shard_size)]
+    trades = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part in pool.map(run_shard, shards):
+            trades += part
+    trades = pd.DataFrame(trades)
+    return trades, summarize(trades)
+
+
+def build(data_dir, tickers, years):
+    # 唯一需要連網的步驟：把多年日線抓進本地資料夾
+    store = PriceStore(root=data_dir, max_rows=(years + 1) * 260, full_period=f"{years + 1}y")
+    _, metrics = store.top_up(tickers, progress_cb=lambda n, total: print(f"\r下載 {n}/{total} 批", end=""))
+    print(f"\n完成，失敗 {len(metrics.failures)} 檔")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="突破策略歷史回測 (離線)")
+    ap.add_argument("--data-dir", default="data/history")
+    ap.add_argument("--strategy", default=DEFAULT_STRATEGY)
+    ap.add_argument("--years", type=int, default=5)
+    ap.add_argument("--max-hold", type=int, default=60, help="最長持有交易日數，到期以收盤價出場")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--out", help="逐筆交易輸出 CSV")
+    ap.add_argument("--build", action="store_true", help="先下載資料到 --data-dir (需連網)")
+    args = ap.parse_args()
+
+    from universe import load_universe
+    universe = load_universe().tickers
+    if args.build: build(args.data_dir, universe, args.years)
+    trades, stats = backtest(args.data_dir, universe, args.strategy, args.years, args.max_hold, args.workers)
+    for k, v in stats.items():
+        print(f"{k:>14}: {v:.4f}" if isinstance(v, float) else f"{k:>14}: {v}")
+    if args.out and not trades.empty: trades.to_csv(args.out, index=False)
@@ -0,0 +1,94 @@
+import os
+import sys
+import tempfile
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_tickers, make_frames, synthetic_universe
+from market_data import LocalProvider
+from price_store import PriceStore
+from screener import screen
+from strategies import STRATEGIES, DEFAULT_STRATEGY
+
+# --- 回歸檢查：向量化選股 (screener.screen) 必須與舊版逐檔迴圈 (run_full_scan) 的結果完全相同 ---
+# python benchmarks/check_screener.py            # 不一致時列出差異並以非 0 結束
+COLS = ["代碼", "全代碼", "產業", "現價", "成交量", "停損", "停利", "週20MA"]
+
+
+def legacy_scan(frames, universe, chunk_size=50):
+    # 舊版 stock2.run_full_scan 的判斷邏輯 (去掉 Streamlit 與 yf.download)，一檔一檔 dropna / rolling
+    qualified = []
+    tickers = list(universe)
+    for i in range(0, len(tickers), chunk_size):
+        for t in tickers[i : i + chunk_size]:
+            try:
+                df = frames[t].dropna()
+                if len(df) < 100: continue
+                df_weekly = df['Close'].resample('W').last()
+                w_ma20 = df_weekly.rolling(20).mean().iloc[-1]
+                c = df['Close'].iloc[-1]
+                p_c = df['Close'].iloc[-2]
+                v = df['Volume'].iloc[-1]
+                ma5, ma10, ma20, ma60 = df['Close'].rolling(5).mean().iloc[-1], df['Close'].rolling(10).mean().iloc[-1], df['Close'].rolling(20).mean().iloc[-1], df['Close'].rolling(60).mean().iloc[-1]
+                ma60_p = df['Close'].rolling(60).mean().iloc[-2]
+                v20_a = df['Volume'].rolling(20).mean().iloc[-1]
+                day_ret = (c - p_c) / p_c
+                if (
+                    (max([ma5,ma10,ma20])-min([ma5,ma10,ma20]))/min([ma5,ma10,ma20]) <= 0.03 and
+                    ma60 > ma60_p and c > max([ma5,ma10,ma20,ma60]) and
+                    c > w_ma20 and
+                    v > (v20_a * 2.0) and
+                    day_ret >= 0.025 and
+                    v >= 2000000
+                ):
+                    qualified.append({
+                        "代碼": universe.code(t), "全代碼": t, "產業": universe.industry(t),
+                        "現價": round(c, 2), "成交量": int(v // 2000),
+                        "停損": round(ma20, 2), "停利": round(c*1.2, 2),
+                        "週20MA": round(w_ma20, 2)
+                    })
+            except Exception: continue
+    return qualified
+
+
+def make_cases(n=400, seed=11):
+    # 合成行情再加上實際會遇到的情況：停牌缺日、資料太短、只有部分欄位缺值、完全沒資料
+    tickers = make_tickers(n)
+    frames = make_frames(tickers, 250, breakout_every=4)
+    rng = np.random.default_rng(seed)
+    for k, t in enumerate(tickers):
+        df = frames[t]
+        if k % 7 == 1:
+            frames[t] = df.drop(df.index[rng.choice(len(df) - 2, 15, replace=False)])
+        elif k % 7 == 2:
+            frames[t] = df.iloc[-int(rng.integers(60, 130)):]
+        elif k % 7 == 3:
+            df = df.copy(); df.iloc[rng.choice(len(df) - 2, 5, replace=False), 4] = np.nan; frames[t] = df
+        elif k % 7 == 4 and k % 5 == 0:
+            del frames[t]
+    return tickers, frames
+
+
+def main():
+    tickers, frames = make_cases()
+    universe = synthetic_universe(tickers)
+    # 新版走實際路徑：LocalProvider → PriceStore 寬表 → screen
+    store = PriceStore(root=tempfile.mkdtemp(prefix="check_store_"), provider=LocalProvider(frames))
+    panels, _ = store.top_up(tickers)
+    new = [{k: r[k] for k in COLS} for r in screen(panels, universe, {DEFAULT_STRATEGY: STRATEGIES[DEFAULT_STRATEGY]})]
+    old = legacy_scan(frames, universe)
+    print(f"legacy {len(old)} 檔 / vectorized {len(new)} 檔 (共 {len(tickers)} 檔)")
+    if new == old:
+        print("OK 結果完全相同")
+        return 0
+    a, b = {r["全代碼"]: r for r in old}, {r["全代碼"]: r for r in new}
+    for t in sorted(set(a) | set(b)):
+        if a.get(t) != b.get(t): print(f"  {t}\n    legacy:     {a.get(t)}\n    vectorized: {b.get(t)}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import json
+import time
+import types
+import pandas as pd
+
+# --- 基準測試用替身：取代 yfinance (download / Ticker) 與 Supabase client，完全不連網 ---
+
+
+def fake_yfinance(frames, latency=0.0):
+    # 回傳一個可放進 sys.modules["yfinance"] 的假模組
+    mod = types.ModuleType("yfinance")
+    mod.calls = 0
+
+    class Ticker:
+        def __init__(self, ticker):
+            self.ticker = ticker
+
+        def history(self, period=None, start=None, auto_adjust=True, **kw):
+            mod.calls += 1
+            if latency: time.sleep(latency)
+            df = frames.get(self.ticker)
+            if df is None: return pd.DataFrame()
+            if start is not None: return df.loc[pd.Timestamp(start):].copy()
+            if period and period.endswith("d"): return df.iloc[-int(period[:-1]):].copy()
+            return df.copy()
+
+    def download(tickers, period=None, start=None, group_by='ticker', **kw):
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        parts = {t: Ticker(t).history(period=period, start=start) for t in tickers}
+        parts = {t: df for t, df in parts.items() if not df.empty}
+        return pd.concat(parts, axis=1) if parts else pd.DataFrame()
+
+    mod.Ticker = Ticker
+    mod.download = download
+    return mod
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, client, table, op, payload=None, cols="*", on_conflict=None, ignore_duplicates=False):
+        self.client, self.table, self.op = client, table, op
+        self.payload, self.cols, self.on_conflict = payload, cols, on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        self.filters, self._order, self._range = [], None, None
+
+    def eq(self, col, val):
+        self.filters.append(lambda r: r.get(col) == val); return self
+
+    def in_(self, col, vals):
+        vals = set(vals); self.filters.append(lambda r: r.get(col) in vals); return self
+
+    def order(self, col, desc=False):
+        self._order = (col, desc); return self
+
+    def range(self, a, b):
+        self._range = (a, b); return self
+
+    def _match(self, r):
+        return all(f(r) for f in self.filters)
+
+    def execute(self):
+        rows = self.client.tables.setdefault(self.table, [])
+        self.client.requests += 1
+        if self.payload is not None:
+            self.client.payload_bytes += len(json.dumps(self.payload, default=float))
+        if self.op == "select":
+            out = [r for r in rows if self._match(r)]
+            if self._order: out.sort(key=lambda r: r.get(self._order[0]), reverse=self._order[1])
+            if self._range: out = out[self._range[0] : self._range[1] + 1]
+            if self.cols != "*":
+                keep = [c.strip() for c in self.cols.split(",")]
+                out = [{k: r.get(k) for k in keep} for r in out]
+            data = out
+        elif self.op == "insert":
+            new = self.payload if isinstance(self.payload, list) else [self.payload]
+            for r in new:
+                self.client.seq += 1; rows.append({"id": self.client.seq, **r})
+            data = new
+        elif self.op == "upsert":
+            keys = self.on_conflict.split(",")
+            index = {tuple(x.get(k) for k in keys): x for x in rows}
+            for r in (self.payload if isinstance(self.payload, list) else [self.payload]):
+                hit = index.get(tuple(r[k] for k in keys))
+                if hit:
+                    if not self.ignore_duplicates: hit.update(r)
+                else:
+                    self.client.seq += 1; rows.append({"id": self.client.seq, **r})
+                    index[tuple(r[k] for k in keys)] = rows[-1]
+            data = self.payload
+        elif self.op == "update":
+            data = [r for r in rows if self._match(r)]
+            for r in data: r.update(self.payload)
+        else:
+            data = [r for r in rows if self._match(r)]
+            self.client.tables[self.table] = [r for r in rows if not self._match(r)]
+        self.client.bytes_read += len(json.dumps(data, default=float)) if self.op == "select" else 0
+        return _Result(data)
+
+
+class _Rpc:
+    def __init__(self, client, name, params):
+        self.client, self.name, self.params = client, name, params
+
+    def execute(self):
+        self.client.requests += 1
+        self.client.payload_bytes += len(json.dumps(self.params, default=float))
+        return _Result(getattr(self.client, "rpc_" + self.name)(**self.params))
+
+
+class _Table:
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+
+    def select(self, cols="*"): return _Query(self.client, self.name, "select", cols=cols)
+    def insert(self, rows): return _Query(self.client, self.name, "insert", rows)
+    def update(self, fields): return _Query(self.client, self.name, "update", fields)
+    def upsert(self, rows, on_conflict="id", ignore_duplicates=False):
+        return _Query(self.client, self.name, "upsert", rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+    def delete(self): return _Query(self.client, self.name, "delete")
+
+
+class FakeSupabase:
+    # 記憶體內的 Supabase 替身，並統計請求次數與上傳/下載的 JSON 大小
+    def __init__(self):
+        self.tables, self.seq = {}, 0
+        self.requests = self.payload_bytes = self.bytes_read = 0
+
+    def table(self, name):
+        return _Table(self, name)
+
+    def rpc(self, name, params):
+        return _Rpc(self, name, params)
+
+    def rpc_record_trades(self, p_username, p_trades):
+        # 與 repository.SCHEMA_SQL 的 record_trades 相同：略過重複 uid，只累加新增的成交
+        trades = self.tables.setdefault("trades", [])
+        months = self.tables.setdefault("monthly_pnl", [])
+        seen = {r.get("uid") for r in trades}
+        for t in p_trades:
+            if t["uid"] in seen: continue
+            seen.add(t["uid"])
+            self.seq += 1
+            trades.append({"id": self.seq, "username": p_username, **t})
+            m = next((r for r in months if r["username"] == p_username and r["month"] == t["month"]), None)
+            if m is None:
+                m = {"username": p_username, "month": t["month"], "realized": 0.0, "trades": 0, "wins": 0}
+                months.append(m)
+            profit = t.get("profit") or 0.0
+            m["realized"] += profit; m["trades"] += 1; m["wins"] += int(profit > 0)
+        return None
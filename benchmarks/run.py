@@ -0,0 +1,234 @@
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_tickers, make_frames, make_history, synthetic_universe
+from fakes import fake_yfinance, FakeSupabase
+
+# --- 基準測試：合成行情 + 假 Yahoo/Supabase，量測各階段耗時、峰值記憶體與配置次數 ---
+# python benchmarks/run.py                      # 與 benchmarks/baseline.json 比較
+# python benchmarks/run.py --save-baseline      # 更新基準值
+# python benchmarks/check_screener.py          # 向量化選股與舊版逐檔迴圈的結果比對 (須完全相同)
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def install_yf(frames, latency):
+    sys.modules["yfinance"] = fake_yfinance(frames, latency)
+
+
+# 每個情境：setup(cfg) 建立狀態，run(state) 為被量測的部分 (回傳額外指標)
+def setup_universe(cfg):
+    return None
+
+def run_universe(_):
+    from universe import load_universe
+    u = load_universe()
+    return {"tickers": len(u), "search": len(u.search("台積")) + len(u.search("23"))}
+
+
+def setup_scan_cold(cfg):
+    frames = make_frames(make_tickers(cfg.tickers), cfg.days)
+    install_yf(frames, cfg.latency)
+    return {"root": tempfile.mkdtemp(prefix="bench_store_"), "frames": frames}
+
+def run_scan_cold(state):
+    from price_store import PriceStore
+    panels, metrics = PriceStore(root=state["root"]).top_up(list(state["frames"]))
+    state["panels"] = panels
+    return {"failed": len(metrics.failures)}
+
+
+def setup_scan_warm(cfg):
+    # 先以舊資料建好本地庫，再讓 Yahoo 多出一根新 K 棒
+    state = setup_scan_cold(cfg)
+    old = {t: df.iloc[:-1] for t, df in state["frames"].items()}
+    install_yf(old, 0.0)
+    run_scan_cold({"root": state["root"], "frames": old})
+    install_yf(state["frames"], cfg.latency)
+    return state
+
+def run_scan_warm(state):
+    return run_scan_cold(state)
+
+
+def run_scan_first_hit(state):
+    # 串流掃描：從冷啟動到第一檔命中出現在雷達頁的時間
+    from price_store import PriceStore
+    from screener import screen
+    stream = PriceStore(root=state["root"]).top_up_iter(list(state["frames"]))
+    for n, total, chunk, view, _ in stream:
+        if screen(view, synthetic_universe(chunk)): break
+    stream.close()
+    return {"chunks": n, "of": total}
+
+
+def setup_screen(cfg):
+    frames = make_frames(make_tickers(cfg.tickers), cfg.days)
+    panels = {f: pd.concat({t: df[f] for t, df in frames.items()}, axis=1) for f in ["Open", "High", "Low", "Close", "Volume"]}
+    return {"panels": panels, "universe": synthetic_universe(frames)}
+
+def run_screen(state):
+    from screener import screen
+    return {"hits": len(screen(state["panels"], state["universe"]))}
+
+
+def setup_portfolio(cfg, warm=False):
+    frames = make_frames(make_tickers(cfg.holdings), 65, breakout_every=0)
+    install_yf(frames, cfg.latency)
+    from quote_service import QuoteService
+    qs = QuoteService()
+    if warm: qs.get(list(frames))
+    return {"qs": qs, "tickers": list(frames)}
+
+def run_portfolio(state):
+    return {"quotes": len(state["qs"].get(state["tickers"]))}
+
+
+def setup_alerts(cfg):
+    # cfg.holdings 位使用者各持有 10 檔、自選 5 檔，代碼取自同一組 cfg.holdings * 2 檔
+    import random
+    from repository import SupabaseRepository
+    from quote_service import QuoteService
+    from alert_service import AlertService
+    tickers = make_tickers(cfg.holdings * 2)
+    frames = make_frames(tickers, 65, breakout_every=0)
+    install_yf(frames, cfg.latency)
+    rng = random.Random(7)
+    client = FakeSupabase()
+    repo = SupabaseRepository(client)
+    for i in range(cfg.holdings):
+        user = f"user{i}"
+        repo.create(user, 1000000)
+        held = rng.sample(tickers, 10)
+        repo.apply(user, {"user": {"watchlist": rng.sample(tickers, 5)},
+                          "positions": {t: {"q": 1.0, "c": frames[t]["Close"].iloc[-1] * 1000 * rng.uniform(0.8, 1.2)} for t in held}})
+    client.requests = client.payload_bytes = client.bytes_read = 0
+    return {"client": client, "service": AlertService(repo, QuoteService(), market_hours_only=False),
+            "yf": sys.modules["yfinance"]}
+
+def run_alerts(state):
+    rows = state["service"].run_once()
+    stats = state["service"].stats()
+    return {"users": stats["users"], "tickers": stats["tickers"], "fetches": state["yf"].calls,
+            "alerts": len(rows), "requests": state["client"].requests}
+
+
+def setup_history(cfg):
+    from repository import SupabaseRepository
+    client = FakeSupabase()
+    repo = SupabaseRepository(client)
+    repo.create("bench", 1000000)
+    history = make_history(cfg.history)
+    repo.apply("bench", {"trades": history,
+                         "positions": {t: {"q": 1.0, "c": 100000.0} for t in make_tickers(cfg.holdings)}})
+    client.requests = client.payload_bytes = client.bytes_read = 0
+    return {"client": client, "repo": repo}
+
+def _io(client):
+    return {"requests": client.requests, "payload_bytes": client.payload_bytes, "bytes_read": client.bytes_read}
+
+def run_history_login(state):
+    state["repo"].load("bench")
+    return _io(state["client"])
+
+def run_history_page(state):
+    state["repo"].list_trades("bench", limit=50, offset=0)
+    return _io(state["client"])
+
+def run_history_sell(state):
+    w = state["repo"].writer("bench", window=0)
+    w.add_trade({"date": "2026-10-16 10:00", "month": "2026-10", "stock": "1000", "qty": 1.0, "profit": 1.0, "pct": "0.1%"})
+    w.set_balance(1000001.0)
+    w.set_position("1000.TW", None)
+    w.commit()
+    return _io(state["client"])
+
+
+SCENARIOS = {
+    "universe.load": (setup_universe, run_universe),
+    "scan.top_up_cold": (setup_scan_cold, run_scan_cold),
+    "scan.top_up_warm": (setup_scan_warm, run_scan_warm),
+    "scan.first_hit": (setup_scan_cold, run_scan_first_hit),
+    "scan.screen": (setup_screen, run_screen),
+    "portfolio.refresh_cold": (setup_portfolio, run_portfolio),
+    "portfolio.refresh_warm": (lambda cfg: setup_portfolio(cfg, warm=True), run_portfolio),
+    "alerts.cycle": (setup_alerts, run_alerts),
+    "history.login": (setup_history, run_history_login),
+    "history.page": (setup_history, run_history_page),
+    "history.sell": (setup_history, run_history_sell),
+}
+
+
+def cleanup(state):
+    if isinstance(state, dict) and "root" in state: shutil.rmtree(state["root"], ignore_errors=True)
+
+
+def measure(name, cfg):
+    setup, run = SCENARIOS[name]
+    # 第一次只計時 (不開 tracemalloc 以免拖慢)，第二次用全新狀態量記憶體
+    state = setup(cfg); gc.collect()
+    t0 = time.perf_counter()
+    extra = run(state)
+    wall = time.perf_counter() - t0
+    cleanup(state)
+    state = setup(cfg); gc.collect()
+    blocks0 = sys.getallocatedblocks()
+    tracemalloc.start()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks0
+    cleanup(state)
+    return {"wall_s": round(wall, 4), "peak_mb": round(peak / 2**20, 2), "net_blocks": blocks, **(extra or {})}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b: continue
+        for k in ("wall_s", "peak_mb"):
+            # 太小的數字只看絕對差，避免雜訊誤報
+            floor = 0.05 if k == "wall_s" else 1.0
+            if r[k] > max(b[k] * tolerance, b[k] + floor):
+                regressions.append(f"{name}.{k}: {b[k]} -> {r[k]}")
+    return regressions
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="飆股王效能基準測試")
+    ap.add_argument("--tickers", type=int, default=1800)
+    ap.add_argument("--days", type=int, default=250)
+    ap.add_argument("--holdings", type=int, default=50)
+    ap.add_argument("--history", type=int, default=10000)
+    ap.add_argument("--latency", type=float, default=0.0, help="假 Yahoo 每次請求延遲秒數")
+    ap.add_argument("--only", help="只跑名稱含此字串的情境")
+    ap.add_argument("--tolerance", type=float, default=1.3)
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--save-baseline", action="store_true")
+    cfg = ap.parse_args()
+
+    results = {}
+    for name in SCENARIOS:
+        if cfg.only and cfg.only not in name: continue
+        results[name] = measure(name, cfg)
+        print(f"{name:<24} " + "  ".join(f"{k}={v}" for k, v in results[name].items()), flush=True)
+
+    if cfg.save_baseline:
+        with open(cfg.baseline, "w") as fh: json.dump(results, fh, indent=2, ensure_ascii=False)
+        print(f"已寫入基準值 {cfg.baseline}")
+    elif os.path.exists(cfg.baseline):
+        with open(cfg.baseline) as fh: regressions = compare(results, json.load(fh), cfg.tolerance)
+        for r in regressions: print(f"⚠️ 效能退步 {r}")
+        sys.exit(1 if regressions else 0)
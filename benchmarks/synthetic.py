@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+# --- 可重現的合成行情：固定 seed，每次產生完全相同的 OHLCV ---
+
+
+def make_tickers(n):
+    # 前半上市、後半上櫃，代碼格式與 universe.load_universe 相同
+    return [f"{1000 + i}.TW" if i < n // 2 else f"{1000 + i}.TWO" for i in range(n)]
+
+
+def synthetic_universe(tickers):
+    from universe import Universe
+    return Universe([(*t.split('.'), "合成", "測試業") for t in tickers])
+
+
+def make_frames(tickers, n_days=250, end="2026-10-16", seed=7, breakout_every=40):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=end, periods=n_days)
+    frames = {}
+    for i, t in enumerate(tickers):
+        c = (20 + rng.random() * 300) * np.cumprod(1 + rng.normal(0.0003, 0.018, n_days))
+        v = rng.lognormal(14.3, 0.7, n_days).round()
+        if breakout_every and i % breakout_every == 0:
+            # 每隔幾檔做一個「均線糾結後帶量長紅」的型態，讓掃描有命中
+            c[-40:-1] = c[-41] * (1 + rng.normal(0, 0.002, 39))
+            c[-1] = c[-2] * 1.06
+            v[-1] = v[-21:-1].mean() * 4 + 2_500_000
+        o = c * (1 + rng.normal(0, 0.004, n_days))
+        frames[t] = pd.DataFrame({
+            "Open": o, "High": np.maximum(o, c) * (1 + rng.random(n_days) * 0.01),
+            "Low": np.minimum(o, c) * (1 - rng.random(n_days) * 0.01), "Close": c, "Volume": v,
+        }, index=dates)
+    return frames
+
+
+def make_history(n_rows, seed=7):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_rows):
+        month = f"{2020 + i * 6 // n_rows}-{i % 12 + 1:02d}"
+        profit = float(rng.normal(500, 8000))
+        rows.append({"date": f"{month}-15 10:{i % 60:02d}", "month": month, "stock": str(1000 + i % 900),
+                     "qty": 1.0, "profit": profit, "pct": f"{profit / 1000:.2f}%"})
+    return rows
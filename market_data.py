@@ -0,0 +1,90 @@
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+
+# --- 行情來源抽象層：Yahoo 正式環境、LocalProvider 供測試/離線使用 ---
+FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+class MarketDataProvider:
+    retries = 2
+    backoff = 1.0
+
+    def history(self, ticker, start=None, period=None):
+        raise NotImplementedError
+
+    def download(self, tickers, start=None, period=None):
+        # 逐檔抓取並各自重試；回傳 ({代碼: DataFrame}, {代碼: 失敗原因})
+        frames, errors = {}, {}
+        for t in tickers:
+            for attempt in range(self.retries + 1):
+                try:
+                    df = self.history(t, start=start, period=period)
+                    if df is None or df.empty:
+                        errors[t] = "empty"
+                    else:
+                        frames[t] = df[[f for f in FIELDS if f in df.columns]]
+                        errors.pop(t, None)
+                    break
+                except Exception as e:
+                    errors[t] = f"{type(e).__name__}: {e}"
+                    if attempt < self.retries:
+                        time.sleep(self.backoff * (2 ** attempt) * (1 + random.random() * 0.2))
+        return frames, errors
+
+
+class YahooProvider(MarketDataProvider):
+    def history(self, ticker, start=None, period=None):
+        import yfinance as yf
+        if start is not None:
+            df = yf.Ticker(ticker).history(start=start, auto_adjust=True)
+        else:
+            df = yf.Ticker(ticker).history(period=period or "250d", auto_adjust=True)
+        if df.index.tz is not None:
+            df.index = df.index.tz_localize(None)  # 與 yf.download 一致：保留當地日期、去掉時區
+        return df
+
+
+class LocalProvider(MarketDataProvider):
+    # 測試/基準用假來源：從 {代碼: DataFrame} 回傳，可模擬延遲與失敗
+    def __init__(self, frames, latency=0.0, fail=None):
+        self.frames = frames
+        self.latency = latency
+        self.fail = set(fail or [])
+        self.calls = 0
+
+    def history(self, ticker, start=None, period=None):
+        self.calls += 1
+        if self.latency: time.sleep(self.latency)
+        if ticker in self.fail: raise ConnectionError(f"{ticker} unavailable")
+        df = self.frames.get(ticker)
+        if df is None: return pd.DataFrame()
+        if start is not None: return df.loc[pd.Timestamp(start):]
+        if period and period.endswith("d"): return df.iloc[-int(period[:-1]):]
+        return df
+
+
+def fetch_chunks(provider, jobs, period=None, max_workers=8):
+    # jobs: [(start, [代碼...]), ...]；有限的執行緒池同時抓多批，
+    # 完成一批就 yield 一批，讓呼叫端在其他批還在下載時就先合併/計算
+    if not jobs: return
+
+    def run(start, chunk):
+        t0 = time.perf_counter()
+        frames, errors = provider.download(chunk, start=start, period=period)
+        return frames, errors, time.perf_counter() - t0
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futs = {pool.submit(run, start, chunk): (start, chunk) for start, chunk in jobs}
+        for fut in as_completed(futs):
+            start, chunk = futs[fut]
+            try:
+                frames, errors, elapsed = fut.result()
+            except Exception as e:
+                frames, errors, elapsed = {}, {t: f"{type(e).__name__}: {e}" for t in chunk}, 0.0
+            yield start, chunk, frames, errors, elapsed
+    finally:
+        # 呼叫端提早停止 (取消掃描) 時，還沒開始的批次直接丟棄，不等它們下載完
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,217 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from market_data import FIELDS, YahooProvider, fetch_chunks
+from scan_metrics import ScanMetrics
+
+# --- 本地行情庫：每個欄位一張 (日期 x 代碼) 寬表，存成可 memmap 的 NumPy 陣列 ---
+
+
+class PriceStore:
+    def __init__(self, root="data/prices", max_rows=400, overlap_days=5, max_gap_days=30,
+                 full_period="250d", chunk_size=50, provider=None, max_workers=8, adjust_tol=0.002):
+        self.root = root
+        self.provider = provider or YahooProvider()
+        self.max_workers = max_workers  # 同時下載的批數
+        self.max_rows = max_rows            # 每檔最多保留的交易日數
+        self.overlap_days = overlap_days    # 補資料時往回重抓幾天，用來覆蓋 Yahoo 事後修正
+        self.max_gap_days = max_gap_days    # 缺口超過此天數就整段重抓
+        self.adjust_tol = adjust_tol        # 重疊區間的舊收盤價差超過此比例 → 視為除權息回溯調整，整段重抓
+        self.full_period = full_period
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._panels = None
+        self._mtime = None
+
+    def _meta_path(self):
+        return os.path.join(self.root, "meta.json")
+
+    def _disk_mtime(self):
+        p = self._meta_path()
+        return os.path.getmtime(p) if os.path.exists(p) else None
+
+    def load(self, columns=None):
+        # 記憶體有快取且磁碟沒變動就直接回傳，避免每次掃描都重讀檔案；
+        # 指定 columns 時只從 memmap 讀出那幾檔 (回測分片用)，不進快取
+        with self._lock:
+            mtime = self._disk_mtime()
+            if columns is None and self._panels is not None and mtime == self._mtime:
+                return self._panels
+            meta = self.meta() if mtime is not None else {}
+            if not meta.get("file"):
+                return {f: pd.DataFrame(dtype=float) for f in FIELDS}
+            arr = np.load(os.path.join(self.root, meta["file"]), mmap_mode="r")
+            index, tickers = pd.DatetimeIndex(meta["dates"]), meta["tickers"]
+            if columns is not None:
+                pos = {t: i for i, t in enumerate(tickers)}
+                tickers = [t for t in columns if t in pos]
+                arr = arr[:, :, [pos[t] for t in tickers]]
+            cols = pd.Index(tickers, dtype=object)
+            panels = {f: pd.DataFrame(np.array(arr[k]), index=index, columns=cols) for k, f in enumerate(FIELDS)}
+            if columns is None: self._panels, self._mtime = panels, mtime
+            return panels
+
+    def save(self, panels):
+        # 五個欄位疊成一個 (欄位, 日期, 代碼) 的 .npy，讀取時以 memmap 開啟；
+        # 每次寫新檔再切換 meta，讀取中的程序不會讀到寫一半的資料
+        os.makedirs(self.root, exist_ok=True)
+        close = panels["Close"]
+        arr = np.stack([panels[f].reindex(index=close.index, columns=close.columns).to_numpy(dtype=float) for f in FIELDS])
+        with self._lock:
+            old = self.meta().get("file")
+            name = f"ohlcv-{datetime.now().strftime('%Y%m%d%H%M%S%f')}.npy"
+            np.save(os.path.join(self.root, name), arr)
+            meta = {"updated": datetime.now().isoformat(timespec="seconds"), "file": name,
+                    "dates": [d.strftime("%Y-%m-%d") for d in close.index], "tickers": list(close.columns)}
+            tmp = self._meta_path() + ".tmp"
+            with open(tmp, "w") as fh: json.dump(meta, fh)
+            os.replace(tmp, self._meta_path())
+            if old and old != name and os.path.exists(os.path.join(self.root, old)):
+                os.remove(os.path.join(self.root, old))
+            self._panels, self._mtime = panels, self._disk_mtime()
+
+    def meta(self):
+        try:
+            with open(self._meta_path()) as fh: return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def last_dates(self, tickers, panels=None):
+        close = (panels or self.load())["Close"]
+        out = dict.fromkeys(tickers)
+        if close.empty: return out
+        valid = close.notna().to_numpy()
+        last = valid.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+        for t, has, i in zip(close.columns, valid.any(axis=0), last):
+            if has and t in out: out[t] = close.index[i]
+        return out
+
+    def plan(self, tickers, today=None):
+        # 依最後一筆日期分組：同一起始日的代碼分在同一批下載
+        today = pd.Timestamp(today or datetime.now().date())
+        groups = {}
+        for t, last in self.last_dates(tickers).items():
+            if last is None or (today - last).days > self.max_gap_days:
+                key = None  # 沒有資料或缺口太大 → 整段重抓
+            else:
+                key = (last - timedelta(days=self.overlap_days)).strftime("%Y-%m-%d")
+            groups.setdefault(key, []).append(t)
+        return groups
+
+    def to_wide(self, frames):
+        # {代碼: OHLCV} → {欄位: (日期 x 代碼) 寬表}，每批下載完成就先轉好
+        if not frames: return {}
+        tickers = list(frames)
+        idx = frames[tickers[0]].index
+        for df in frames.values():
+            if not df.index.equals(idx): idx = idx.union(df.index)
+        arr = np.full((len(FIELDS), len(idx), len(tickers)), np.nan)
+        for j, t in enumerate(tickers):
+            df = frames[t]
+            if list(df.columns) != FIELDS: df = df.reindex(columns=FIELDS)
+            if not df.index.equals(idx): df = df.reindex(idx)
+            arr[:, :, j] = df.to_numpy(dtype=float).T
+        cols = pd.Index(tickers, dtype=object)
+        return {f: pd.DataFrame(arr[k], index=idx, columns=cols) for k, f in enumerate(FIELDS)}
+
+    def adjusted(self, panels, part):
+        # auto_adjust 的資料在除權息後會回頭改掉所有舊K線，只覆蓋重疊的幾天會留下新舊混雜的序列。
+        # 比對重疊區間內 (各檔最後一筆之前，最後一筆可能是盤中價) 的收盤價，對不上的代碼要整段重抓
+        close, new = panels["Close"], part.get("Close")
+        if new is None or close.empty: return []
+        cols = [t for t in new.columns if t in close.columns]
+        dates = new.index.intersection(close.index)
+        if not cols or dates.empty: return []
+        o = close.reindex(index=dates, columns=cols).to_numpy(dtype=float)
+        u = new.reindex(index=dates, columns=cols).to_numpy(dtype=float)
+        has = ~np.isnan(o)
+        later = np.cumsum(has[::-1], axis=0)[::-1] > 1  # 之後還有舊資料 = 不是最後一筆
+        with np.errstate(invalid="ignore"):
+            off = np.abs(u - o) > self.adjust_tol * np.abs(o)
+        stale = (off & has & later & ~np.isnan(u)).any(axis=0)
+        return [t for t, x in zip(cols, stale) if x]
+
+    def merge(self, panels, parts, replace=()):
+        # 新抓的資料覆蓋重疊區間 (修正)，其餘保留舊值；整批一次用 numpy 合併。
+        # replace 內的代碼是整段重抓的 (除權息調整)，舊值整欄丟掉
+        if not parts: return panels
+        out = {}
+        for f in FIELDS:
+            pieces = [p[f] for p in parts if f in p]
+            old = panels[f]
+            if not pieces:
+                out[f] = old; continue
+            upd = pd.concat(pieces, axis=1)
+            if old.empty:
+                merged = upd
+            else:
+                idx = old.index.union(upd.index)
+                cols = old.columns.union(upd.columns, sort=False)
+                o = old.reindex(index=idx, columns=cols).to_numpy(dtype=float, copy=bool(replace))
+                if replace: o[:, cols.isin(list(replace))] = np.nan
+                u = upd.reindex(index=idx, columns=cols).to_numpy(dtype=float)
+                merged = pd.DataFrame(np.where(np.isnan(u), o, u), index=idx, columns=cols)
+            out[f] = merged.sort_index().iloc[-self.max_rows:]
+        return out
+
+    def top_up_iter(self, tickers, metrics=None, checkpoint_every=0, views=True):
+        # 每下載完一批就 yield (第幾批, 總批數, 本批代碼, 本批面板, 是否已寫回)；
+        # 本批面板 = 舊資料疊上剛抓到的資料，呼叫端可以馬上拿去選股。
+        # 每 checkpoint_every 批寫回磁碟一次 (0 = 全部抓完才寫)；呼叫端中途 close() 也會先寫回。
+        # views=False 時不組本批面板 (只要整批更新、不逐批選股的呼叫端)
+        metrics = metrics or ScanMetrics()
+        with metrics.stage("load_store"):
+            panels = self.load()
+            jobs = []
+            for start, group in self.plan(tickers).items():
+                for i in range(0, len(group), self.chunk_size):
+                    jobs.append((start, group[i : i + self.chunk_size]))
+        parts, replaced = [], set()
+
+        def flush():
+            nonlocal panels, parts, replaced
+            if not parts: return
+            with metrics.stage("merge_save"):
+                panels = self.merge(panels, parts, replaced)
+                self.save(panels)
+            parts, replaced = [], set()
+
+        stream = fetch_chunks(self.provider, jobs, period=self.full_period, max_workers=self.max_workers)
+        try:
+            for n in range(1, len(jobs) + 1):
+                with metrics.stage("download"):
+                    start, chunk, frames, errors, elapsed = next(stream)
+                for t, reason in errors.items(): metrics.fail(t, reason)
+                metrics.chunk(start, len(chunk), elapsed, len(errors))
+                part = self.to_wide(frames)
+                stale = self.adjusted(panels, part) if start is not None and part else []
+                if stale:
+                    with metrics.stage("download"):
+                        full, errs = self.provider.download(stale, period=self.full_period)
+                    for t, reason in errs.items(): metrics.fail(t, reason)
+                    metrics.count("adjusted_refetch", len(full))
+                    # 重抓失敗的代碼這次不更新 (下次補資料會再比對到)，成功的整欄換掉
+                    keep = [t for t in part["Close"].columns if t not in stale]
+                    part = {f: part[f][keep] for f in FIELDS}
+                    if full: part = self.merge(part, [self.to_wide(full)])
+                    replaced |= set(full)
+                view = None
+                if views:
+                    old = {f: panels[f].reindex(columns=chunk) for f in FIELDS}
+                    view = self.merge(old, [part], set(full) if stale else ()) if part else old
+                if part: parts.append(part)
+                if checkpoint_every and len(parts) >= checkpoint_every: flush()
+                yield n, len(jobs), chunk, view, not parts
+        finally:
+            stream.close()
+            flush()
+
+    def top_up(self, tickers, progress_cb=None, metrics=None):
+        # 回傳 (panels, metrics)；metrics 記錄各階段耗時、每批延遲與逐檔失敗原因
+        metrics = metrics or ScanMetrics()
+        for n, total, _, _, _ in self.top_up_iter(tickers, metrics, views=False):
+            if progress_cb: progress_cb(n, total)
+        return self.load(), metrics
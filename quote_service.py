@@ -0,0 +1,94 @@
+import time
+import threading
+from market_data import YahooProvider, fetch_chunks
+
+# --- 全站共用報價快取：批次抓取、短 TTL、過期時先回舊值並在背景更新 ---
+
+
+def make_quote(df):
+    close = df['Close'].dropna()
+    if close.empty: return None
+    return {
+        "close": float(close.iloc[-1]),
+        "prev_close": float(close.iloc[-2]) if len(close) > 1 else None,
+        "ma20": float(close.rolling(20).mean().iloc[-1]),
+        "ma60": float(close.rolling(60).mean().iloc[-1]),
+        "ts": time.time(),
+    }
+
+
+class QuoteService:
+    def __init__(self, provider=None, ttl=60, max_stale=1800, period="65d", max_workers=8, wait_timeout=30):
+        self.provider = provider or YahooProvider()
+        self.ttl = ttl                # 秒數內視為新鮮，直接回傳
+        self.max_stale = max_stale    # 超過 ttl 但未超過此秒數：先回舊值、背景更新
+        self.period = period
+        self.max_workers = max_workers
+        self.wait_timeout = wait_timeout  # 等別的 session 抓同一批代碼最多幾秒
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)  # 每批抓完通知等待中的 get
+        self._cache = {}
+        self._nodata = {}             # 查無資料 (下市/停牌) 的代碼 → 時間，ttl 內不再重抓
+        self._inflight = set()
+
+    def _fetch(self, tickers):
+        size = max(1, -(-len(tickers) // self.max_workers))  # 平均分給每個執行緒
+        jobs = [(None, tickers[i : i + size]) for i in range(0, len(tickers), size)]
+        fresh, nodata = {}, []
+        try:
+            for _, _, frames, errors, _ in fetch_chunks(self.provider, jobs, period=self.period, max_workers=self.max_workers):
+                for t, df in frames.items():
+                    q = make_quote(df)
+                    if q: fresh[t] = q
+                    else: nodata.append(t)
+                # 只有「沒有資料」記成負快取；連線錯誤下次照常重試
+                nodata += [t for t, reason in errors.items() if reason == "empty"]
+        finally:
+            with self._lock:
+                self._cache.update(fresh)
+                now = time.time()
+                for t in fresh: self._nodata.pop(t, None)
+                for t in nodata: self._nodata[t] = now
+                self._inflight.difference_update(tickers)
+                self._done.notify_all()
+        return fresh
+
+    def _revalidate(self, tickers):
+        with self._lock:
+            tickers = [t for t in tickers if t not in self._inflight]
+            self._inflight.update(tickers)
+        if tickers:
+            threading.Thread(target=self._fetch, args=(tickers,), name="quote-refresh", daemon=True).start()
+
+    def get(self, tickers, sync=False):
+        # 回傳 {代碼: quote}；完全沒有或太舊的同步批次抓，稍舊的背景更新。
+        # sync=True (警示引擎) 時超過 ttl 的也同步重抓，判斷用的一定是新報價
+        # 別的 session 正在抓的代碼不重抓，等它抓完直接讀快取；查無資料的代碼 ttl 內直接略過
+        now = time.time()
+        out, stale, missing, waiting = {}, [], [], []
+        with self._lock:
+            for t in dict.fromkeys(tickers):
+                if t in self._nodata and now - self._nodata[t] <= self.ttl: continue
+                q = self._cache.get(t)
+                age = now - q["ts"] if q else None
+                if q is None or age > self.max_stale or (sync and age > self.ttl):
+                    (waiting if t in self._inflight else missing).append(t)
+                else:
+                    out[t] = q
+                    if age > self.ttl: stale.append(t)
+            self._inflight.update(missing)
+        if stale: self._revalidate(stale)
+        if missing: out.update(self._fetch(missing))
+        if waiting:
+            with self._done:
+                self._done.wait_for(lambda: self._inflight.isdisjoint(waiting), timeout=self.wait_timeout)
+                for t in waiting:
+                    q = self._cache.get(t)
+                    if q and time.time() - q["ts"] <= (self.ttl if sync else self.max_stale): out[t] = q
+        return out
+
+    def invalidate(self, tickers):
+        with self._lock:
+            for t in tickers:
+                self._cache.pop(t, None)
+                self._nodata.pop(t, None)
@@ -0,0 +1,410 @@
+import json
+import uuid
+import sqlite3
+import threading
+
+# --- 會員資料存取層：持股逐檔存、交易只新增不改寫、同一 session 的連續寫入合併送出 ---
+# Supabase 需先在 SQL editor 建立下列資料表 (SQLiteRepository 會自動建立同樣結構)
+SCHEMA_SQL = """
+alter table users add column if not exists migrated boolean default false;
+create table if not exists positions (
+    username text not null, ticker text not null,
+    q double precision not null, c double precision not null,
+    stop_loss double precision, take_profit double precision,
+    primary key (username, ticker)
+);
+create table if not exists trades (
+    id bigserial primary key, username text not null, uid text,
+    date text, month text, stock text, qty double precision, profit double precision, pct text
+);
+alter table trades add column if not exists uid text;
+create unique index if not exists trades_uid on trades (uid);
+create index if not exists trades_user_month on trades (username, month);
+create table if not exists monthly_pnl (
+    username text not null, month text not null,
+    realized double precision not null default 0, trades integer not null default 0, wins integer not null default 0,
+    primary key (username, month)
+);
+create table if not exists alerts (
+    id bigserial primary key, username text not null, ticker text not null, kind text not null,
+    price double precision, level double precision, created_at text, seen boolean not null default false
+);
+create index if not exists alerts_unseen on alerts (username) where not seen;
+-- 觸發中的警示 active=true 且 open_key = 使用者|代碼|類型 (唯一)；條件解除時清掉，重啟或多個副本都不會重複通知
+alter table alerts add column if not exists active boolean not null default false;
+alter table alerts add column if not exists open_key text;
+create unique index if not exists alerts_open on alerts (open_key);
+-- 成交與月彙總在同一個交易裡寫入：uid 重複的成交直接略過，只有真的新增的才加進月彙總
+create or replace function record_trades(p_username text, p_trades jsonb) returns void language sql as $$
+    with ins as (
+        insert into trades (username, uid, date, month, stock, qty, profit, pct)
+        select p_username, t->>'uid', t->>'date', t->>'month', t->>'stock',
+               (t->>'qty')::double precision, (t->>'profit')::double precision, t->>'pct'
+        from jsonb_array_elements(p_trades) t
+        on conflict (uid) do nothing
+        returning month, coalesce(profit, 0) as profit
+    )
+    insert into monthly_pnl (username, month, realized, trades, wins)
+    select p_username, month, sum(profit), count(*), count(*) filter (where profit > 0) from ins group by month
+    on conflict (username, month) do update set
+        realized = monthly_pnl.realized + excluded.realized,
+        trades = monthly_pnl.trades + excluded.trades,
+        wins = monthly_pnl.wins + excluded.wins;
+$$;
+"""
+
+POSITION_COLS = ["q", "c", "stop_loss", "take_profit"]
+TRADE_COLS = ["date", "month", "stock", "qty", "profit", "pct"]
+MONTH_COLS = ["realized", "trades", "wins"]
+ALERT_COLS = ["ticker", "kind", "price", "level", "created_at"]
+
+
+def alert_key(username, ticker, kind):
+    return f"{username}|{ticker}|{kind}"
+
+
+def position_row(username, ticker, d):
+    return {"username": username, "ticker": ticker, **{k: d.get(k) for k in POSITION_COLS}}
+
+
+def add_to_month(m, profit):
+    # 每筆賣出只更新當月彙總，不重算整段歷史
+    m = m or {"realized": 0.0, "trades": 0, "wins": 0}
+    return {"realized": m["realized"] + profit, "trades": m["trades"] + 1, "wins": m["wins"] + int(profit > 0)}
+
+
+class UserRepository:
+    # 子類別實作下列基本操作；apply() 負責把合併後的變更依序寫入
+    def exists(self, username): raise NotImplementedError
+    def create(self, username, balance): raise NotImplementedError
+    def load(self, username): raise NotImplementedError
+    def update_user(self, username, fields): raise NotImplementedError
+    def upsert_positions(self, rows): raise NotImplementedError
+    def delete_positions(self, username, tickers=None): raise NotImplementedError
+    def record_trades(self, username, rows): raise NotImplementedError  # 新增成交並在同一交易內累加月彙總
+    def delete_trades(self, username): raise NotImplementedError
+    def list_trades(self, username, month=None, limit=50, offset=0): raise NotImplementedError
+    def delete_months(self, username): raise NotImplementedError
+    # 以下給全站警示引擎使用
+    def all_positions(self): raise NotImplementedError
+    def all_watchlists(self): raise NotImplementedError
+    def insert_alerts(self, rows): raise NotImplementedError
+    def open_alert_keys(self): raise NotImplementedError  # 仍在觸發中的 (使用者, 代碼, 類型)
+    def clear_alerts(self, keys): raise NotImplementedError  # 條件解除：之後再觸發才會通知
+    def list_alerts(self, username): raise NotImplementedError
+    def mark_alerts_seen(self, username, ids): raise NotImplementedError
+    def delete_alerts(self, username): raise NotImplementedError
+
+    def apply(self, username, ch):
+        # 成交 (連同月彙總) 先寫：中途失敗時餘額/持股還沒動；整批重送也安全 (成交以 uid 去重，其餘都是覆寫)
+        if ch.get("reset"):
+            self.delete_positions(username)
+            self.delete_trades(username)
+            self.delete_months(username)
+            self.delete_alerts(username)
+        if ch.get("trades"):
+            self.record_trades(username, [{"uid": e.get("uid") or uuid.uuid4().hex, **{k: e.get(k) for k in TRADE_COLS}}
+                                          for e in ch["trades"]])
+        if ch.get("user"):
+            self.update_user(username, ch["user"])
+        upserts = [position_row(username, t, d) for t, d in ch.get("positions", {}).items() if d is not None]
+        deletes = [t for t, d in ch.get("positions", {}).items() if d is None]
+        if upserts: self.upsert_positions(upserts)
+        if deletes: self.delete_positions(username, deletes)
+
+    def writer(self, username, window=1.0):
+        return WriteBuffer(self, username, window)
+
+    def _to_user(self, row, positions, months):
+        # 歷史明細不隨登入載入，只帶每月彙總；明細由 list_trades 分頁讀取
+        return {
+            "balance": row["balance"], "watchlist": row.get("watchlist") or [],
+            "portfolio": {p["ticker"]: {k: p[k] for k in POSITION_COLS} for p in positions},
+            "monthly": {m["month"]: {k: m[k] for k in MONTH_COLS} for m in months},
+        }
+
+
+class WriteBuffer:
+    # 同一 session 在 window 秒內的多次寫入合併成一次：餘額只送最後值、持股逐檔 upsert
+    def __init__(self, repo, username, window=1.0):
+        self.repo = repo
+        self.username = username
+        self.window = window
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending = {}
+        self._retries = 0
+        self.last_error = None
+
+    def set_balance(self, bal):
+        with self._lock: self._pending.setdefault("user", {})["balance"] = bal
+
+    def set_watchlist(self, watchlist):
+        with self._lock: self._pending.setdefault("user", {})["watchlist"] = list(watchlist)
+
+    def set_position(self, ticker, d):
+        # d 為 None 代表已全部賣出
+        with self._lock: self._pending.setdefault("positions", {})[ticker] = dict(d) if d is not None else None
+
+    def add_trade(self, entry):
+        # uid 在送出前就決定，重送同一筆不會變成兩筆
+        entry = {"uid": uuid.uuid4().hex, **entry}
+        with self._lock: self._pending.setdefault("trades", []).append(entry)
+
+    def pending_trades(self, month=None):
+        # 尚未送出的成交，讓明細頁在合併寫入前也看得到
+        with self._lock: trades = list(self._pending.get("trades", []))
+        return [e for e in reversed(trades) if month is None or e["month"] == month]
+
+    def reset(self, bal):
+        with self._lock: self._pending = {"reset": True, "user": {"balance": bal}}
+
+    def commit(self):
+        if self.window <= 0: return self.flush()
+        self._schedule(self.window)
+
+    def _schedule(self, delay):
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(delay, self._flush_later)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_later(self):
+        # 計時器執行緒裡不能把例外往外丟 (沒有人接)：變更已放回佇列，退避後再送
+        try:
+            self.flush()
+            self._retries, self.last_error = 0, None
+        except Exception as e:
+            self._retries += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._schedule(min(self.window * 2 ** self._retries, 60))
+
+    def flush(self):
+        with self._lock:
+            ch, self._pending = self._pending, {}
+            if self._timer is not None: self._timer.cancel()
+            self._timer = None
+        if not ch: return
+        try:
+            self.repo.apply(self.username, ch)
+        except Exception:
+            # 寫入失敗就放回佇列，下次 commit/flush 再送
+            with self._lock: self._pending = merge_changes(ch, self._pending)
+            raise
+
+
+def merge_changes(old, new):
+    if new.get("reset"): return new
+    out = {k: v for k, v in old.items()}
+    out["user"] = {**old.get("user", {}), **new.get("user", {})}
+    out["positions"] = {**old.get("positions", {}), **new.get("positions", {})}
+    out["trades"] = old.get("trades", []) + new.get("trades", [])
+    return out
+
+
+class SupabaseRepository(UserRepository):
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, username):
+        return bool(self.client.table("users").select("username").eq("username", username).execute().data)
+
+    def create(self, username, balance):
+        self.client.table("users").insert({"username": username, "balance": balance, "portfolio": {}, "history": [],
+                                           "watchlist": [], "migrated": True}).execute()
+
+    def load(self, username):
+        res = self.client.table("users").select("balance, watchlist, migrated").eq("username", username).execute()
+        if not res.data: return None
+        row = res.data[0]
+        if not row.get("migrated"): self._migrate(username)
+        positions = self.client.table("positions").select("ticker, " + ", ".join(POSITION_COLS)).eq("username", username).execute().data
+        months = self.client.table("monthly_pnl").select("month, " + ", ".join(MONTH_COLS)).eq("username", username).execute().data
+        return self._to_user(row, positions, months)
+
+    def _migrate(self, username):
+        # 舊資料整包存在 users.portfolio / users.history，第一次登入時搬到新資料表
+        # 成交 uid 依舊資料的位置決定，重跑或兩個 session 同時搬也不會重複寫入
+        legacy = self.client.table("users").select("portfolio, history").eq("username", username).execute().data[0]
+        history = [{**e, "uid": f"legacy-{username}-{i}"} for i, e in enumerate(legacy.get("history") or [])]
+        self.apply(username, {"positions": legacy.get("portfolio") or {}, "trades": history})
+        self.update_user(username, {"portfolio": {}, "history": [], "migrated": True})
+
+    def update_user(self, username, fields):
+        self.client.table("users").update(fields).eq("username", username).execute()
+
+    def upsert_positions(self, rows):
+        self.client.table("positions").upsert(rows, on_conflict="username,ticker").execute()
+
+    def delete_positions(self, username, tickers=None):
+        q = self.client.table("positions").delete().eq("username", username)
+        if tickers is not None: q = q.in_("ticker", list(tickers))
+        q.execute()
+
+    def record_trades(self, username, rows):
+        # 月彙總由資料庫端累加 (見 SCHEMA_SQL 的 record_trades)，多個 session 同時賣出也不會互相覆蓋
+        self.client.rpc("record_trades", {"p_username": username, "p_trades": rows}).execute()
+
+    def delete_trades(self, username):
+        self.client.table("trades").delete().eq("username", username).execute()
+
+    def list_trades(self, username, month=None, limit=50, offset=0):
+        q = self.client.table("trades").select(", ".join(TRADE_COLS)).eq("username", username)
+        if month: q = q.eq("month", month)
+        return q.order("id", desc=True).range(offset, offset + limit - 1).execute().data
+
+    def delete_months(self, username):
+        self.client.table("monthly_pnl").delete().eq("username", username).execute()
+
+    def _select_all(self, q, page=1000):
+        # PostgREST 一次最多回 1000 列，全站讀取要分頁讀完
+        rows, start = [], 0
+        while True:
+            batch = q().range(start, start + page - 1).execute().data
+            rows += batch
+            if len(batch) < page: return rows
+            start += page
+
+    def all_positions(self):
+        return self._select_all(lambda: self.client.table("positions").select("username, ticker, " + ", ".join(POSITION_COLS))
+                                .order("username").order("ticker"))
+
+    def all_watchlists(self):
+        rows = self._select_all(lambda: self.client.table("users").select("username, watchlist").order("username"))
+        return {r["username"]: r["watchlist"] for r in rows if r.get("watchlist")}
+
+    def insert_alerts(self, rows):
+        # open_key 唯一：兩個監控同時寫同一筆警示只會留下一筆
+        rows = [{**r, "seen": False, "active": True, "open_key": alert_key(r["username"], r["ticker"], r["kind"])} for r in rows]
+        self.client.table("alerts").upsert(rows, on_conflict="open_key", ignore_duplicates=True).execute()
+
+    def open_alert_keys(self):
+        rows = self._select_all(lambda: self.client.table("alerts").select("username, ticker, kind").eq("active", True).order("id"))
+        return {(r["username"], r["ticker"], r["kind"]) for r in rows}
+
+    def clear_alerts(self, keys):
+        self.client.table("alerts").update({"active": False, "open_key": None}) \
+            .in_("open_key", [alert_key(*k) for k in keys]).execute()
+
+    def list_alerts(self, username):
+        return self.client.table("alerts").select("id, " + ", ".join(ALERT_COLS)).eq("username", username) \
+            .eq("seen", False).order("id").execute().data
+
+    def mark_alerts_seen(self, username, ids):
+        self.client.table("alerts").update({"seen": True}).eq("username", username).in_("id", list(ids)).execute()
+
+    def delete_alerts(self, username):
+        self.client.table("alerts").delete().eq("username", username).execute()
+
+
+class SQLiteRepository(UserRepository):
+    # 本機/測試替身，結構與 Supabase 相同
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.db.executescript("""
+            create table if not exists users (username text primary key, balance real, watchlist text default '[]');
+            create table if not exists positions (username text, ticker text, q real, c real, stop_loss real,
+                take_profit real, primary key (username, ticker));
+            create table if not exists trades (id integer primary key autoincrement, username text, uid text,
+                date text, month text, stock text, qty real, profit real, pct text);
+            create index if not exists trades_user_month on trades (username, month);
+            create table if not exists monthly_pnl (username text, month text, realized real, trades integer,
+                wins integer, primary key (username, month));
+            create table if not exists alerts (id integer primary key autoincrement, username text, ticker text,
+                kind text, price real, level real, created_at text, seen integer default 0);
+        """)
+        for table, col in (("trades", "uid text"), ("alerts", "active integer default 0"), ("alerts", "open_key text")):
+            try:
+                self.db.execute(f"alter table {table} add column {col}")  # 舊的本機資料庫
+            except sqlite3.OperationalError:
+                pass
+        self.db.execute("create unique index if not exists trades_uid on trades (uid)")
+        self.db.execute("create unique index if not exists alerts_open on alerts (open_key)")
+
+    def _q(self, sql, args=()):
+        with self._lock, self.db:
+            return [dict(r) for r in self.db.execute(sql, args).fetchall()]
+
+    def exists(self, username):
+        return bool(self._q("select username from users where username = ?", (username,)))
+
+    def create(self, username, balance):
+        self._q("insert into users (username, balance, watchlist) values (?, ?, '[]')", (username, balance))
+
+    def load(self, username):
+        rows = self._q("select balance, watchlist from users where username = ?", (username,))
+        if not rows: return None
+        row = {**rows[0], "watchlist": json.loads(rows[0]["watchlist"] or "[]")}
+        positions = self._q("select ticker, q, c, stop_loss, take_profit from positions where username = ?", (username,))
+        months = self._q("select month, realized, trades, wins from monthly_pnl where username = ?", (username,))
+        return self._to_user(row, positions, months)
+
+    def update_user(self, username, fields):
+        fields = {k: json.dumps(v) if k == "watchlist" else v for k, v in fields.items()}
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        self._q(f"update users set {sets} where username = ?", (*fields.values(), username))
+
+    def upsert_positions(self, rows):
+        for r in rows:
+            self._q("insert or replace into positions (username, ticker, q, c, stop_loss, take_profit) values (?, ?, ?, ?, ?, ?)",
+                    (r["username"], r["ticker"], r["q"], r["c"], r["stop_loss"], r["take_profit"]))
+
+    def delete_positions(self, username, tickers=None):
+        if tickers is None:
+            self._q("delete from positions where username = ?", (username,))
+        else:
+            for t in tickers: self._q("delete from positions where username = ? and ticker = ?", (username, t))
+
+    def record_trades(self, username, rows):
+        with self._lock, self.db:
+            for r in rows:
+                cur = self.db.execute(f"insert or ignore into trades (username, uid, {', '.join(TRADE_COLS)}) values (?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (username, r["uid"], *[r[k] for k in TRADE_COLS]))
+                if not cur.rowcount: continue
+                profit = r.get("profit") or 0.0
+                self.db.execute("""insert into monthly_pnl (username, month, realized, trades, wins) values (?, ?, ?, 1, ?)
+                                   on conflict (username, month) do update set realized = realized + excluded.realized,
+                                   trades = trades + 1, wins = wins + excluded.wins""",
+                                (username, r["month"], profit, int(profit > 0)))
+
+    def delete_trades(self, username):
+        self._q("delete from trades where username = ?", (username,))
+
+    def list_trades(self, username, month=None, limit=50, offset=0):
+        where, args = "username = ?", [username]
+        if month: where, args = where + " and month = ?", args + [month]
+        return self._q(f"select {', '.join(TRADE_COLS)} from trades where {where} order by id desc limit ? offset ?",
+                       (*args, limit, offset))
+
+    def delete_months(self, username):
+        self._q("delete from monthly_pnl where username = ?", (username,))
+
+    def all_positions(self):
+        return self._q("select username, ticker, q, c, stop_loss, take_profit from positions order by username, ticker")
+
+    def all_watchlists(self):
+        rows = self._q("select username, watchlist from users")
+        return {r["username"]: json.loads(r["watchlist"]) for r in rows if json.loads(r["watchlist"] or "[]")}
+
+    def insert_alerts(self, rows):
+        for r in rows:
+            self._q(f"insert or ignore into alerts (username, {', '.join(ALERT_COLS)}, active, open_key) values (?, ?, ?, ?, ?, ?, 1, ?)",
+                    (r["username"], *[r[k] for k in ALERT_COLS], alert_key(r["username"], r["ticker"], r["kind"])))
+
+    def open_alert_keys(self):
+        return {(r["username"], r["ticker"], r["kind"]) for r in self._q("select username, ticker, kind from alerts where active = 1")}
+
+    def clear_alerts(self, keys):
+        for k in keys: self._q("update alerts set active = 0, open_key = null where open_key = ?", (alert_key(*k),))
+
+    def list_alerts(self, username):
+        return self._q(f"select id, {', '.join(ALERT_COLS)} from alerts where username = ? and seen = 0 order by id", (username,))
+
+    def mark_alerts_seen(self, username, ids):
+        for i in ids: self._q("update alerts set seen = 1 where username = ? and id = ?", (username, i))
+
+    def delete_alerts(self, username):
+        self._q("delete from alerts where username = ?", (username,))
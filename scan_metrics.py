@@ -0,0 +1,64 @@
+import os
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- 掃描量測：各階段耗時、被略過的代碼 (依原因)、每批下載延遲與失敗 ---
+
+
+class ScanMetrics:
+    def __init__(self):
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.stages = {}
+        self.skips = Counter()
+        self.chunks = []
+        self.failures = {}
+        self.errors = []
+        self.counts = {}
+        self.reason = None  # 觸發原因 (scheduled / manual)，不放進數量統計
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(self.stages.get(name, 0.0) + time.perf_counter() - t0, 4)
+
+    def count(self, name, n=1):
+        # 串流掃描會逐批呼叫，數量用累加
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+
+    def skip(self, reason, n=1):
+        if n: self.skips[reason] += int(n)
+
+    def fail(self, ticker, reason):
+        # 下載失敗只記在 failures；庫存裡還有舊資料的代碼照樣會選股，沒資料的由選股端算成 no_data
+        self.failures[ticker] = reason
+
+    def chunk(self, start, size, seconds, failed):
+        self.chunks.append({"start": start, "size": size, "seconds": round(seconds, 3), "failed": failed})
+
+    def error(self, where, exc):
+        self.errors.append({"where": where, "error": f"{type(exc).__name__}: {exc}"})
+
+    def to_dict(self):
+        secs = [c["seconds"] for c in self.chunks]
+        return {
+            "started": self.started, "reason": self.reason, "stages": self.stages, "counts": self.counts, "skips": dict(self.skips),
+            "chunks": self.chunks, "chunk_p50": sorted(secs)[len(secs) // 2] if secs else None,
+            "chunk_max": max(secs) if secs else None, "failures": self.failures, "errors": self.errors,
+        }
+
+    def dump(self, root):
+        # latest 給管理頁與外部監控讀；jsonl 保留歷次紀錄方便看趨勢
+        os.makedirs(root, exist_ok=True)
+        d = self.to_dict()
+        tmp = os.path.join(root, "metrics.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as fh: json.dump(d, fh, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(root, "metrics.json"))
+        with open(os.path.join(root, "metrics.jsonl"), "a", encoding="utf-8") as fh:
+            fh.write(json.dumps({k: v for k, v in d.items() if k not in ("chunks", "failures")}, ensure_ascii=False) + "\n")
+        return d
@@ -0,0 +1,206 @@
+import os
+import json
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from screener import screen
+from scan_metrics import ScanMetrics
+
+# --- 全站共用掃描服務：背景排程掃描一次，所有使用者讀同一份快照 ---
+TZ = ZoneInfo("Asia/Taipei")
+MARKET_OPEN, MARKET_CLOSE = "09:00", "13:35"
+
+
+def _at(now, hhmm):
+    hh, mm = map(int, hhmm.split(':'))
+    return now.replace(hour=hh, minute=mm, second=0, microsecond=0)
+
+
+class ScanService:
+    def __init__(self, store, tickers_fn, root="data/scan", interval_min=0, daily_at="14:00", poll_sec=30,
+                 checkpoint_every=6, retry_min=5, retry_max_min=60, cancel_hold_min=60):
+        self.store = store
+        self.tickers_fn = tickers_fn  # 回傳 universe.Universe
+        self.root = root
+        self.interval_min = interval_min  # 0 = 只在每日收盤後掃一次；>0 = 盤中每隔幾分鐘掃一次
+        self.daily_at = daily_at
+        self.poll_sec = poll_sec
+        self.checkpoint_every = checkpoint_every  # 每幾批把行情與已完成代碼寫回一次，中斷後從這裡接續
+        self.retry_min = retry_min              # 掃描出錯後排程等多久再試 (連續出錯就加倍，最多 retry_max_min)
+        self.retry_max_min = retry_max_min
+        self.cancel_hold_min = cancel_hold_min  # 被取消後排程至少等多久才自動重跑
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._partial = []
+        self._worker = None
+        self._scheduler = None
+        self._progress = (0, 0)
+        self._sched_errors = []
+        self._last_attempt = None   # 最近一次開始掃描的時間 (不論成功與否)
+        self._last_outcome = None   # "ok" / "error" / "cancelled"
+        self._failures = 0          # 連續出錯次數
+        self._snap = self._load() or {"version": 0, "finished_at": None, "data_date": None, "results": [], "failures": 0}
+
+    def _path(self):
+        return os.path.join(self.root, "latest.json")
+
+    def _load(self):
+        try:
+            with open(self._path(), encoding="utf-8") as fh: return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, snap, path=None):
+        path = path or self._path()
+        os.makedirs(self.root, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh: json.dump(snap, fh, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _checkpoint_path(self):
+        return os.path.join(self.root, "checkpoint.json")
+
+    def _load_checkpoint(self):
+        # 只接續同一天 (台北時間) 中斷的掃描；隔天行情已變，重新開始
+        try:
+            with open(self._checkpoint_path(), encoding="utf-8") as fh: ckpt = json.load(fh)
+        except (OSError, ValueError):
+            return {"done": [], "results": []}
+        return ckpt if ckpt.get("day") == datetime.now(TZ).date().isoformat() else {"done": [], "results": []}
+
+    def _save_checkpoint(self, done, results):
+        self._save({"day": datetime.now(TZ).date().isoformat(), "done": sorted(done), "results": results},
+                   self._checkpoint_path())
+
+    def metrics(self):
+        # 最近一次掃描的量測 (metrics.json)；管理頁與外部監控共用
+        try:
+            with open(os.path.join(self.root, "metrics.json"), encoding="utf-8") as fh: d = json.load(fh)
+        except (OSError, ValueError):
+            d = {}
+        with self._lock:
+            d["scheduler_errors"] = list(self._sched_errors)
+            d["last_attempt"] = self._last_attempt.isoformat(timespec="seconds") if self._last_attempt else None
+            d["last_outcome"] = self._last_outcome
+        return d
+
+    def snapshot(self):
+        with self._lock:
+            snap = dict(self._snap)
+            snap["running"] = self._worker is not None and self._worker.is_alive()
+            snap["progress"] = self._progress
+            snap["partial"] = list(self._partial) if snap["running"] else []
+        return snap
+
+    def cancel(self):
+        # 停止目前的掃描；已抓到的行情與已完成的代碼會留在 checkpoint，下次掃描從中斷處接續
+        if not self.snapshot()["running"]: return False
+        self._cancel.set()
+        return True
+
+    def refresh(self, reason="manual"):
+        # 已有掃描在跑就不重複啟動 (多位使用者同時按下只會掃一次)
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive(): return False
+            self._cancel.clear()
+            self._last_attempt = datetime.now(TZ)
+            self._worker = threading.Thread(target=self._run, args=(reason,), name="scan-worker", daemon=True)
+            self._worker.start()
+        return True
+
+    def _run(self, reason):
+        metrics = ScanMetrics()
+        metrics.reason = reason
+        try:
+            with metrics.stage("universe"):
+                universe = self.tickers_fn()
+            ckpt = self._load_checkpoint()
+            done, results = set(ckpt["done"]), list(ckpt["results"])
+            if done: metrics.count("resumed", len(done))
+            with self._lock: self._partial = list(results)
+            # 每批下載完就只對這一批選股，結果立即放進 partial 讓雷達頁先顯示；
+            # 行情寫回磁碟後才把這幾批記進 checkpoint，避免記錄了沒存到的資料
+            pending, pending_results = [], []
+            stream = self.store.top_up_iter([t for t in universe if t not in done], metrics, self.checkpoint_every)
+            try:
+                for n, total, chunk, view, flushed in stream:
+                    self._progress = (n, total)
+                    hits = screen(view, universe.subset(chunk), metrics=metrics)
+                    pending += chunk
+                    pending_results += hits
+                    with self._lock: self._partial += hits
+                    if flushed:
+                        done.update(pending); results += pending_results
+                        pending, pending_results = [], []
+                        self._save_checkpoint(done, results)
+                    if self._cancel.is_set(): break
+            finally:
+                stream.close()  # 會先把已抓到的行情寫回
+            done.update(pending); results += pending_results
+            if self._cancel.is_set():
+                self._save_checkpoint(done, results)
+                metrics.count("cancelled")
+                with self._lock:
+                    self._snap = {**self._snap, "interrupted": f"{len(done)}/{len(universe)}"}
+                    self._last_outcome = "cancelled"
+                return
+            close = self.store.load()['Close']
+            last = close.index.max() if len(close) else None
+            snap = {
+                "version": self._snap["version"] + 1,
+                "finished_at": datetime.now(TZ).isoformat(timespec="seconds"),
+                "data_date": last.strftime("%Y-%m-%d") if last is not None else None,
+                "results": results, "failures": len(metrics.failures), "reason": reason,
+            }
+            self._save(snap)
+            with self._lock:
+                self._snap = snap
+                self._last_outcome, self._failures = "ok", 0
+            if os.path.exists(self._checkpoint_path()): os.remove(self._checkpoint_path())
+        except Exception as e:
+            metrics.error("scan", e)
+            with self._lock:
+                self._snap = {**self._snap, "error": f"{type(e).__name__}: {e}"}
+                self._last_outcome, self._failures = "error", self._failures + 1
+        finally:
+            self._progress = (0, 0)
+            try:
+                metrics.dump(self.root)
+            except OSError:
+                pass
+
+    def backoff_sec(self):
+        # finished_at 只在成功時前進；出錯或被取消後要自己等一段時間，不然排程每 poll_sec 就重跑一次
+        with self._lock: outcome, failures = self._last_outcome, self._failures
+        if outcome == "error": return min(self.retry_min * 2 ** (failures - 1), self.retry_max_min) * 60
+        if outcome == "cancelled": return self.cancel_hold_min * 60
+        return 0
+
+    def due(self, now=None):
+        now = now or datetime.now(TZ)
+        if now.weekday() >= 5: return False
+        if self._last_attempt is not None and (now - self._last_attempt).total_seconds() < self.backoff_sec(): return False
+        last = self._snap.get("finished_at")
+        last = datetime.fromisoformat(last) if last else None
+        daily = _at(now, self.daily_at)
+        if now >= daily and (last is None or last < daily): return True
+        if self.interval_min and _at(now, MARKET_OPEN) <= now <= _at(now, MARKET_CLOSE):
+            return last is None or (now - last).total_seconds() >= self.interval_min * 60
+        return False
+
+    def start(self):
+        # 排程執行緒整個 process 只啟動一次
+        if self._scheduler is not None: return self
+        def loop():
+            while True:
+                try:
+                    if self.due(): self.refresh("scheduled")
+                except Exception as e:
+                    # 排程本身出錯不能讓執行緒死掉，但要留下紀錄給管理頁
+                    with self._lock:
+                        self._sched_errors = (self._sched_errors + [f"{datetime.now(TZ):%m-%d %H:%M} {type(e).__name__}: {e}"])[-20:]
+                time.sleep(self.poll_sec)
+        self._scheduler = threading.Thread(target=loop, name="scan-scheduler", daemon=True)
+        self._scheduler.start()
+        return self
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from price_store import FIELDS
+from strategies import load_strategies, with_derived, evaluate
+from scan_metrics import ScanMetrics
+
+# --- 向量化選股引擎：整個市場一次算完，不再逐檔 dropna / rolling ---
+MIN_BARS = 100  # 只用來統計被略過的檔數，實際門檻寫在各策略條件裡
+
+
+def align_panel(panels, tickers):
+    # 對齊成 (日期 x 代碼) 寬表；valid 等同逐檔 dropna() 後留下的列。
+    # 一筆有效列都沒有的代碼 (串流時本批沒抓到的空欄) 與不在面板裡的一樣，直接拿掉
+    cols = [t for t in tickers if t in panels['Close'].columns]
+    p = {f: panels[f].reindex(columns=cols) for f in FIELDS}
+    valid = np.logical_and.reduce([p[f].notna().to_numpy() for f in FIELDS]) if cols else np.zeros((0, 0), bool)
+    if cols and not valid.any(axis=0).all():
+        keep = valid.any(axis=0)
+        p = {f: p[f].loc[:, keep] for f in FIELDS}
+        valid = valid[:, keep]
+    return p, valid
+
+
+def compact(values, valid):
+    # 每檔有效值依原順序往下推齊、前面補 NaN，等同 dropna 後靠右對齊
+    order = np.argsort(valid, axis=0, kind='stable')
+    return np.take_along_axis(np.where(valid, values, np.nan), order, axis=0)
+
+
+def compute_indicators(panels, tickers, metrics=None):
+    metrics = metrics or ScanMetrics()
+    with metrics.stage("dropna"):
+        p, valid = align_panel(panels, tickers)
+        cols = list(p['Close'].columns)
+        metrics.skip("no_data", len(tickers) - len(cols))
+        if not cols or not len(p['Close']):
+            return pd.DataFrame(index=pd.Index([], name='ticker'))
+        close_raw = p['Close'].to_numpy(dtype=float)
+        c_close = pd.DataFrame(compact(close_raw, valid), columns=cols)
+        c_vol = pd.DataFrame(compact(p['Volume'].to_numpy(dtype=float), valid), columns=cols)
+
+    with metrics.stage("rolling_indicators"):
+        ma60_s = c_close.rolling(60).mean()
+        ind = pd.DataFrame({
+            'bars': valid.sum(axis=0),
+            'close': c_close.iloc[-1], 'prev_close': c_close.iloc[-2] if len(c_close) > 1 else np.nan,
+            'volume': c_vol.iloc[-1],
+            'ma5': c_close.rolling(5).mean().iloc[-1], 'ma10': c_close.rolling(10).mean().iloc[-1],
+            'ma20': c_close.rolling(20).mean().iloc[-1], 'ma60': ma60_s.iloc[-1],
+            'ma60_prev': ma60_s.iloc[-2] if len(ma60_s) > 1 else np.nan,
+            'v20_avg': c_vol.rolling(20).mean().iloc[-1],
+        }, index=cols)
+        ind['day_ret'] = (ind['close'] - ind['prev_close']) / ind['prev_close']
+
+    # 週線 20MA：取每檔「最後一筆有效日期」所在那一週的值
+    with metrics.stage("weekly_resample"):
+        masked = pd.DataFrame(np.where(valid, close_raw, np.nan), index=p['Close'].index, columns=cols)
+        w_ma = masked.resample('W').last().rolling(20).mean()
+        last_row = valid.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+        week_pos = w_ma.index.searchsorted(p['Close'].index[last_row])
+        week_pos = np.minimum(week_pos, len(w_ma) - 1)
+        ind['w_ma20'] = w_ma.to_numpy()[week_pos, np.arange(len(cols))]
+
+    metrics.skip("too_few_bars", int((ind['bars'] < MIN_BARS).sum()))  # 每檔只算一個原因：沒資料的已在上面算過
+    ind.index.name = 'ticker'
+    return ind
+
+
+def to_row(t, r, stop, target, tags, universe):
+    return {
+        "代碼": universe.code(t), "全代碼": t, "產業": universe.industry(t),
+        "現價": round(r['close'], 2), "成交量": int(r['volume'] // 2000),
+        "停損": round(stop, 2), "停利": round(target, 2),
+        "週20MA": round(r['w_ma20'], 2), "策略": tags
+    }
+
+
+def screen(panels, universe, strategies=None, metrics=None):
+    # 指標只算一次，所有啟用中的策略共用同一份指標表、同一趟一起判斷
+    strategies = strategies or load_strategies()
+    metrics = metrics or ScanMetrics()
+    ind = compute_indicators(panels, universe.tickers, metrics)
+    metrics.count("universe", len(universe))
+    metrics.count("with_data", len(ind))
+    if ind.empty: return []
+    with metrics.stage("filter_evaluation"):
+        ind = with_derived(ind, strategies)
+        hit = pd.DataFrame(evaluate(ind, strategies), index=ind.index)
+    for name in strategies: metrics.count(f"hits_{name}", hit[name].sum())
+    hit = hit[hit.any(axis=1)]
+    metrics.count("hits", len(hit))
+    if hit.empty: return []
+    sub = ind.loc[hit.index]
+    # 停損/停利取第一個符合的策略所定義的算式
+    levels = {name: (sub.eval(s.get("stop", "ma20"), engine="python"), sub.eval(s.get("target", "close * 1.2"), engine="python"))
+              for name, s in strategies.items()}
+    rows = []
+    for t, r in sub.iterrows():
+        tags = [name for name in strategies if hit.at[t, name]]
+        stop, target = levels[tags[0]]
+        rows.append(to_row(t, r, stop[t], target[t], tags, universe))
+    return rows
@@ -1,11 +1,29 @@
+import time
+_T0 = time.perf_counter()
 import streamlit as st
-import yfinance as yf
-import pandas as pd
+st.set_page_config(page_title="從從容容飆股王", layout="wide")  # 必須是第一個 st 呼叫
+import os
+import json
 import random
-import time
-import twstock
 from datetime import datetime, timedelta
-from supabase import create_client, Client
+from repository import SupabaseRepository, SQLiteRepository, add_to_month
+# pandas / numpy / yfinance / twstock / supabase 都改在用到的函數或分頁裡才 import，登入頁不必等它們載入
+
+# --- 啟動計時：記錄本次執行各段耗時；process 第一次執行 (冷啟動) 另外保留並印到 log ---
+_marks, _t_last = {}, _T0
+
+def mark(name):
+    global _t_last
+    now = time.perf_counter()
+    _marks[name] = round(now - _t_last, 4)
+    _t_last = now
+
+@st.cache_resource
+def boot_report():
+    return {"started": datetime.now().isoformat(timespec="seconds"), "cold": {}, "last_run": {}}
+
+mark("imports")
+
 # --- 外掛：Cookie 記憶功能 ---
 import extra_streamlit_components as st_tags
 
@@ -16,34 +34,54 @@ def get_cookie_manager():
     return st_tags.CookieManager()
 
 cookie_manager = get_cookie_manager()
+mark("cookie")
 
 # Supabase 連線資訊 (保持原樣)
 SUPABASE_URL = "https://jhphmcbqtprfhvdkklps.supabase.co"
 SUPABASE_KEY = "sb_publishable_qfe3kH2yYYXN_PI7KNCZMg_UJmcvJWE"
+
+@st.cache_resource
+def get_repo():
+    # 整個 process 共用一個 client (連線重複使用)，不再每次重跑都 create_client
+    # LOCAL_DB=路徑 時改用本機 SQLite (開發/測試用)
+    if os.environ.get("LOCAL_DB"): return SQLiteRepository(os.environ["LOCAL_DB"])
+    from supabase import create_client
+    return SupabaseRepository(create_client(SUPABASE_URL, SUPABASE_KEY))
+
 try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-except:
+    get_repo()
+except Exception:
     st.error("⚠️ 雲端資料庫連線中斷")
+mark("repo")
+
+def start_session(username, u):
+    st.session_state.update({
+        "login": True, "user": username, "bal": u['balance'], 
+        "port": u['portfolio'], "monthly": u.get('monthly', {}),
+        "watchlist": u.get('watchlist', []),
+        "writer": get_repo().writer(username, window=float(os.environ.get("WRITE_COALESCE_SEC", 1.0)))
+    })
+    # 離線期間背景引擎觸發的警示：登入時顯示一次並標為已讀
+    alerts = get_repo().list_alerts(username)
+    if alerts: get_repo().mark_alerts_seen(username, [a['id'] for a in alerts])
+    st.session_state.alerts = alerts
 
-# 1. 自動登入邏輯
-if not st.session_state.get('login'):
+# 1. 自動登入邏輯 (每個 session 只查一次資料庫，查不到就不再每次重跑都查)
+if not st.session_state.get('login') and not st.session_state.get('auto_login_tried'):
     saved_user = cookie_manager.get('saved_user')
     if saved_user:
+        st.session_state.auto_login_tried = True
         try:
-            res = supabase.table("users").select("*").eq("username", saved_user).execute()
-            if res.data:
-                u = res.data[0]
-                st.session_state.update({
-                    "login": True, "user": saved_user, "bal": u['balance'], 
-                    "port": u['portfolio'], "history": u.get('history', []),
-                    "watchlist": u.get('watchlist', [])
-                })
+            u = get_repo().load(saved_user)
+            if u:
+                start_session(saved_user, u)
                 st.rerun()
         except:
             pass
 
+mark("auto_login")
+
 # --- 1. 初始化與 UI 樣式強化 ---
-st.set_page_config(page_title="從從容容飆股王", layout="wide")
 st.markdown("""
 <style>
 /* 1. 基礎背景與全域文字 */
@@ -112,62 +150,107 @@ input[role="combobox"] { color: #000000 !important; }
 """, unsafe_allow_html=True)
 
 # --- 2. 核心功能函數 ---
-@st.cache_data(ttl=86400)
-def get_all_tickers():
-    mapping = {}
-    for code, info in twstock.twse.items():
-        if len(code) == 4: mapping[f"{code}.TW"] = f"{code} {getattr(info, 'name', '')} ({getattr(info, 'industry', '上市股')})"
-    for code, info in twstock.tpex.items():
-        if len(code) == 4: mapping[f"{code}.TWO"] = f"{code} {getattr(info, 'name', '')} ({getattr(info, 'industry', '上櫃股')})"
-    return mapping
-
-def run_full_scan(tickers_map):
-    qualified = []
-    status = st.empty()
-    progress = st.progress(0)
-    ticker_list = list(tickers_map.keys())
-    chunk_size = 50 
-    
-    for i in range(0, len(ticker_list), chunk_size):
-        chunk = ticker_list[i : i + chunk_size]
-        status.markdown(f"📡 正在掃描 (突破均線糾結強勢策略): **{i}/{len(ticker_list)}** 檔")
-        progress.progress(min(i / len(ticker_list), 1.0))
-        try:
-            data = yf.download(chunk, period="250d", group_by='ticker', progress=False, threads=True)
-            for t in chunk:
-                try:
-                    df = data[t].dropna() if len(chunk) > 1 else data.dropna()
-                    if len(df) < 100: continue
-                    df_weekly = df['Close'].resample('W').last()
-                    w_ma20 = df_weekly.rolling(20).mean().iloc[-1]
-                    c = df['Close'].iloc[-1]
-                    p_c = df['Close'].iloc[-2]
-                    v = df['Volume'].iloc[-1]
-                    ma5, ma10, ma20, ma60 = df['Close'].rolling(5).mean().iloc[-1], df['Close'].rolling(10).mean().iloc[-1], df['Close'].rolling(20).mean().iloc[-1], df['Close'].rolling(60).mean().iloc[-1]
-                    ma60_p = df['Close'].rolling(60).mean().iloc[-2]
-                    v20_a = df['Volume'].rolling(20).mean().iloc[-1]
-                    day_ret = (c - p_c) / p_c
-
-                    if (
-                        (max([ma5,ma10,ma20])-min([ma5,ma10,ma20]))/min([ma5,ma10,ma20]) <= 0.03 and 
-                        ma60 > ma60_p and c > max([ma5,ma10,ma20,ma60]) and 
-                        c > w_ma20 and 
-                        v > (v20_a * 2.0) and 
-                        day_ret >= 0.025 and 
-                        v >= 2000000 
-                    ):
-                        industry_name = tickers_map.get(t).split('(')[-1].replace(')', '')
-                        dynamic_stop = ma20 
-                        qualified.append({
-                            "代碼": t.split('.')[0], "全代碼": t, "產業": industry_name,
-                            "現價": round(c, 2), "成交量": int(v // 2000), 
-                            "停損": round(dynamic_stop, 2), "停利": round(c*1.2, 2),
-                            "週20MA": round(w_ma20, 2)
-                        })
-                except: continue
-        except: continue
-    progress.empty(); status.empty()
-    return qualified
+@st.cache_resource(ttl=86400)
+def get_universe():
+    # 回傳同一個索引物件，不像 cache_data 每次重跑都複製一份
+    from universe import load_universe
+    return load_universe()
+
+SEARCH_LIMIT = 20
+
+@st.cache_resource
+def get_price_store():
+    from price_store import PriceStore
+    return PriceStore(max_workers=int(os.environ.get("SCAN_WORKERS", 8)))
+
+@st.cache_resource
+def get_scan_service():
+    # 全站共用一個排程器：SCAN_INTERVAL_MIN=0 代表每天收盤後 (SCAN_DAILY_AT) 掃一次
+    from scan_service import ScanService
+    from universe import load_universe
+    return ScanService(get_price_store(), load_universe,
+                       interval_min=int(os.environ.get("SCAN_INTERVAL_MIN", 0)),
+                       daily_at=os.environ.get("SCAN_DAILY_AT", "14:00")).start()
+
+HIST_PAGE_SIZE = 50
+
+def history_page(month, page):
+    # 明細按月/按頁向資料庫讀取並暫存在 session；成交筆數變動才重新查詢
+    month = None if month == "全部" else month
+    writer = st.session_state.writer
+    pending = writer.pending_trades(month)
+    key = (month, page, sum(m['trades'] for m in st.session_state.monthly.values()), len(pending))
+    cached = st.session_state.get('hist_page')
+    if not cached or cached['key'] != key:
+        rows = get_repo().list_trades(st.session_state.user, month, limit=HIST_PAGE_SIZE, offset=page * HIST_PAGE_SIZE)
+        st.session_state.hist_page = cached = {'key': key, 'rows': rows}
+    return (pending + cached['rows'])[:HIST_PAGE_SIZE] if page == 0 else cached['rows']
+
+RADAR_PAGE_SIZE = 50
+RADAR_COLS = ["代碼", "產業", "策略", "現價", "成交量", "停損", "停利", "週20MA"]
+
+def radar_view(results, version_key, sel_strats, sort_opt):
+    # 篩選/排序後的結果暫存在 session；買進、換頁等互動重跑時不必再整份重排
+    key = (version_key, tuple(sel_strats), sort_opt)
+    cached = st.session_state.get('radar_view')
+    if not cached or cached['key'] != key:
+        import pandas as pd
+        from strategies import DEFAULT_STRATEGY
+        rows = [dict(x, 策略='、'.join(x.get('策略', [DEFAULT_STRATEGY]))) for x in results
+                if set(x.get('策略', [DEFAULT_STRATEGY])) & set(sel_strats)]
+        df = pd.DataFrame(rows, columns=RADAR_COLS + ["全代碼"])
+        if sort_opt == "現價 (高→低)": df = df.sort_values('現價', ascending=False)
+        elif sort_opt == "現價 (低→高)": df = df.sort_values('現價')
+        elif sort_opt == "成交量 (大→小)": df = df.sort_values('成交量', ascending=False)
+        elif sort_opt == "按產業": df = df.sort_values('產業', kind='stable')
+        st.session_state.radar_view = cached = {'key': key, 'df': df.reset_index(drop=True)}
+    return cached['df']
+
+@st.cache_resource
+def get_quote_service():
+    from quote_service import QuoteService
+    return QuoteService(ttl=int(os.environ.get("QUOTE_TTL_SEC", 60)))
+
+@st.cache_resource
+def get_alert_service():
+    # 全站一個監控執行緒，盤中每 ALERT_INTERVAL_SEC 秒檢查所有人的停損/停利
+    from alert_service import AlertService
+    return AlertService(get_repo(), get_quote_service(), interval_sec=int(os.environ.get("ALERT_INTERVAL_SEC", 300))).start()
+
+@st.fragment(run_every=2)
+def scan_progress(seen_hits, can_cancel):
+    # 掃描中每 2 秒檢查一次；有新命中或掃描結束 (完成/取消/出錯都算) 才整頁重跑，讓雷達清單邊掃邊長。
+    # 掃描是全站共用的，只有管理員能停止
+    scan_service = get_scan_service()
+    snap = scan_service.snapshot()
+    if snap['running']:
+        n, total = snap['progress']
+        p_col, c_col = st.columns([5, 1])
+        p_col.progress(min(n / max(total, 1), 1.0), text=f"📡 背景掃描中 (多策略共用指標): **{n}/{total}** 批 | 已找到 {len(snap['partial'])} 檔")
+        if can_cancel and c_col.button("⏹️ 停止掃描"):
+            scan_service.cancel()
+            st.toast("已停止，下次掃描會從中斷處接續")
+        elif len(snap['partial']) != seen_hits:
+            st.rerun()
+    else:
+        st.rerun()
+
+@st.cache_resource
+def start_background():
+    # 排程掃描與停損監控每個 process 各啟動一次，不等有人登入或打開雷達分頁；
+    # 在另一條執行緒建立，import pandas/yfinance 等不拖慢第一位訪客的登入頁
+    import threading
+    def boot():
+        get_scan_service()
+        get_alert_service()
+    from streamlit.runtime.scriptrunner import add_script_run_ctx
+    t = threading.Thread(target=boot, name="service-boot", daemon=True)
+    add_script_run_ctx(t)  # 讓執行緒內呼叫 cache_resource 的函式時有 context
+    t.start()
+    return t
+
+start_background()
+mark("setup")
 
 # --- 3. 登入/註冊功能與介面 ---
 if 'login' not in st.session_state: st.session_state.login = False
@@ -191,14 +274,9 @@ if not st.session_state.login:
             if pwd != "STOCK2026":
                 st.error("授權碼 請聯繫Line: 811162開通")
             else:
-                res = supabase.table("users").select("*").eq("username", user).execute()
-                if res.data:
-                    u = res.data[0]
-                    st.session_state.update({
-                        "login": True, "user": user, "bal": u['balance'], 
-                        "port": u['portfolio'], "history": u.get('history', []),
-                        "watchlist": u.get('watchlist', [])
-                    })
+                u = get_repo().load(user)
+                if u:
+                    start_session(user, u)
                     cookie_manager.set('saved_user', user, expires_at=datetime.now() + timedelta(days=30))
                     st.rerun()
                 else:
@@ -211,12 +289,10 @@ if not st.session_state.login:
             elif pwd != "STOCK2026":
                 st.error("授權碼 請聯繫Line: 811162開通")
             else:
-                res = supabase.table("users").select("*").eq("username", user).execute()
-                if res.data:
+                if get_repo().exists(user):
                     st.warning("已有此會員帳號")
                 else:
-                    u = {"username": user, "balance": 1000000, "portfolio": {}, "history": [], "watchlist": []}
-                    supabase.table("users").insert(u).execute()
+                    get_repo().create(user, 1000000)
                     st.success("註冊成功！請直接點擊登入")
 
 # --- 4. 主程式分頁 ---
@@ -225,194 +301,323 @@ else:
     stat_col1.markdown(f"👤 您好, **{st.session_state.user}** | 💰 餘額: `${st.session_state.bal:,.0f}`")
     with stat_col2:
         if st.button("🚪 登出", key="logout"):
+            st.session_state.writer.flush()
             cookie_manager.delete('saved_user')
             st.session_state.clear()
             st.rerun()
 
-    tab1, tab2, tab3, tab4 = st.tabs(["🚀 飆股雷達", "💼 雲端模擬倉", "📜 歷史損益", "⭐ 自選清單"])
+    if st.session_state.get('alerts'):
+        with st.container(border=True):
+            st.markdown("#### 🔔 您不在線上時觸發的警示")
+            universe = get_universe()
+            for a in st.session_state.alerts:
+                name = universe.label(a['ticker'])
+                if a['kind'] == 'stop': st.error(f"{a['created_at']} ⚠️ {name} 跌破停損 {a['level']:.2f} (當時 {a['price']:.2f})，建議賣出")
+                else: st.success(f"{a['created_at']} 🎯 {name} 達到停利 {a['level']:.2f} (當時 {a['price']:.2f})")
+            if st.button("✅ 知道了", key="ack_alerts"):
+                st.session_state.alerts = []
+                st.rerun()
+
+    # ADMIN_USERS 以逗號列出可看管理頁的帳號
+    is_admin = st.session_state.user in os.environ.get("ADMIN_USERS", "").split(",")
+    tab_names = ["🚀 飆股雷達", "💼 雲端模擬倉", "📜 歷史損益", "⭐ 自選清單"] + (["🛠️ 管理"] if is_admin else [])
+    # on_change="rerun"：只執行目前選到的分頁 (tab.open)，其他分頁的程式與 import 都不會跑
+    tab1, tab2, tab3, tab4, *admin_tab = st.tabs(tab_names, key="main_tabs", on_change="rerun")
     
-    with tab1:
-        if st.button("🔍 開始 1800 檔全量掃描"):
-            res = run_full_scan(get_all_tickers())
-            st.session_state.scan_res = res 
+    if tab1.open:
+        with tab1:
+            from strategies import load_strategies, DEFAULT_STRATEGY
+            scan_service = get_scan_service()
+            if st.button("🔍 開始 1800 檔全量掃描"):
+                if not scan_service.refresh("manual"):
+                    st.toast("已有掃描進行中，完成後將自動更新")
+            snap = scan_service.snapshot()
+            if snap['running']:
+                scan_progress(len(snap['partial']), is_admin)
+            if snap.get('error'):
+                st.warning(f"⚠️ 上次掃描失敗，顯示前一版結果 ({snap['error']})")
+            elif snap.get('interrupted') and not snap['running']:
+                st.info(f"⏸️ 上次掃描已中斷 (完成 {snap['interrupted']} 檔)，再按一次掃描會從中斷處接續")
         
-        if 'scan_res' in st.session_state:
-            sort_col1, sort_col2 = st.columns([1, 2])
-            with sort_col1:
-                sort_opt = st.selectbox("🔃 排序方式", ["預設", "現價 (高→低)", "現價 (低→高)", "成交量 (大→小)", "按產業"])
+            # 掃描中先顯示已完成批次的命中，完成後換成正式版本
+            streaming = snap['running'] and bool(snap['partial'])
+            if snap['finished_at'] or streaming:
+                if snap['finished_at']:
+                    st.caption(f"🕒 資料更新時間: {snap['finished_at'][:16].replace('T', ' ')} | 行情日期: {snap['data_date']} | 第 {snap['version']} 版 (全站共用)" + (f" | ⚠️ {snap['failures']} 檔下載失敗" if snap['failures'] else ""))
+                sort_col1, sort_col2 = st.columns([1, 2])
+                with sort_col1:
+                    sort_opt = st.selectbox("🔃 排序方式", ["預設", "現價 (高→低)", "現價 (低→高)", "成交量 (大→小)", "按產業"])
+                with sort_col2:
+                    strategy_names = list(load_strategies().keys())
+                    sel_strats = st.multiselect("🏷️ 策略篩選", strategy_names, default=[DEFAULT_STRATEGY] if DEFAULT_STRATEGY in strategy_names else strategy_names)
             
-            display_list = st.session_state.scan_res.copy()
-            if sort_opt == "現價 (高→低)": display_list.sort(key=lambda x: x['現價'], reverse=True)
-            elif sort_opt == "現價 (低→高)": display_list.sort(key=lambda x: x['現價'])
-            elif sort_opt == "成交量 (大→小)": display_list.sort(key=lambda x: x['成交量'], reverse=True)
-            elif sort_opt == "按產業": display_list.sort(key=lambda x: x['產業'])
+                view_df = radar_view(snap['partial'] if streaming else snap['results'],
+                                     (snap['version'], streaming, len(snap['partial'])), sel_strats, sort_opt)
+                if streaming: st.info(f"⏳ 掃描進行中，目前已找到 {len(view_df)} 檔 (持續更新)")
+                else: st.success(f"🎯 掃描完成！共找到 {len(view_df)} 檔符合條件標的")
 
-            st.success(f"🎯 掃描完成！共找到 {len(display_list)} 檔符合條件標的 (停損取 20MA)")
-            
-            for s in display_list:
-                with st.container():
+                # 一頁只送 RADAR_PAGE_SIZE 列到前端；點選一列後在下方共用的買進區下單
+                pages = max((len(view_df) - 1) // RADAR_PAGE_SIZE + 1, 1)
+                page = 0
+                if pages > 1:
+                    page = st.number_input(f"頁次 (共 {pages} 頁)", min_value=1, max_value=pages, value=1, step=1, key="radar_page") - 1
+                page_df = view_df.iloc[page * RADAR_PAGE_SIZE : (page + 1) * RADAR_PAGE_SIZE]
+                # 選取只回傳列位置，資料一變 (串流新增/排序/換頁) 位置就對不上；
+                # 點選當下就換成全代碼記在 session_state，買進區依代碼找列。表格 key 帶上本頁內容，內容變了選取就清掉
+                page_tickers = list(page_df['全代碼'])
+                table_key = f"radar_table_{page}_{hash(tuple(page_tickers))}"
+                def remember_pick(key=table_key, tickers=page_tickers):
+                    rows = st.session_state[key]["selection"]["rows"]
+                    st.session_state.radar_pick = tickers[rows[0]] if rows else None
+                st.dataframe(page_df[RADAR_COLS], use_container_width=True, hide_index=True,
+                             on_select=remember_pick, selection_mode="single-row", key=table_key)
+                hit = view_df[view_df['全代碼'] == st.session_state.get('radar_pick')]
+
+                if hit.empty:
+                    st.caption("👆 點選表格中的一列即可查看詳情並買進")
+                else:
+                    s = hit.iloc[0]
                     st.markdown(f"""
                     <div class='stock-card'>
                         <h3>{s['代碼']} - {s['產業']}</h3>
+                        <p>🏷️ 策略: {s['策略']}</p>
                         <p>💰 目前價格: <span class='price-tag'>${s['現價']}</span> | 📊 成交量: {s['成交量']} 張</p>
-                        <p>🛑 動態停損(20MA): {s['停損']} | 🎯 預設停利: {s['停利']}</p>
+                        <p>🛑 動態停損: {s['停損']} | 🎯 預設停利: {s['停利']}</p>
                         <a href='https://www.wantgoo.com/stock/{s['代碼']}' target='_blank'>📈 查看線圖</a>
                     </div>""", unsafe_allow_html=True)
-                    
-                    with st.expander(f"🛒 買進 {s['代碼']}"):
-                        qty = st.number_input("購買張數", min_value=0.001, value=1.0, step=0.001, key=f"q_{s['代碼']}")
-                        total_cost = qty * 1000 * s['現價']
-                        st.markdown(f"**預計買入總金額： `${total_cost:,.3f}`**")
-                        if st.button(f"確認買進 {qty} 張", key=f"btn_{s['代碼']}"):
-                            if st.session_state.bal >= total_cost:
-                                st.session_state.bal -= total_cost
-                                tk = s['全代碼']
-                                st.session_state.port[tk] = st.session_state.port.get(tk, {'q':0, 'c':0, 'stop_loss': s['停損'], 'take_profit': s['停利']})
-                                st.session_state.port[tk]['q'] += qty
-                                st.session_state.port[tk]['c'] += total_cost
-                                supabase.table("users").update({"balance": st.session_state.bal, "portfolio": st.session_state.port}).eq("username", st.session_state.user).execute()
-                                st.success("交易成功！"); st.rerun()
-                            else: st.error("餘額不足")
-
-    with tab2:
-        total_unrealized_profit = 0
-        col_bal, col_reset = st.columns([3, 1])
-        col_bal.markdown(f"### 💰 帳戶餘額: `${st.session_state.bal:,.0f}`")
-        if col_reset.button("⚠️ 重置 100 萬"):
-            st.session_state.bal = 1000000
-            st.session_state.port = {}
-            st.session_state.history = []
-            supabase.table("users").update({"balance": 1000000, "portfolio": {}, "history": []}).eq("username", st.session_state.user).execute()
-            st.rerun()
+                    qty = st.number_input("購買張數", min_value=0.001, value=1.0, step=0.001, key="radar_qty")
+                    total_cost = qty * 1000 * s['現價']
+                    st.markdown(f"**預計買入總金額： `${total_cost:,.3f}`**")
+                    if st.button(f"🛒 確認買進 {s['代碼']} {qty} 張", key="radar_buy"):
+                        if st.session_state.bal >= total_cost:
+                            st.session_state.bal -= total_cost
+                            tk = s['全代碼']
+                            st.session_state.port[tk] = st.session_state.port.get(tk, {'q':0, 'c':0, 'stop_loss': float(s['停損']), 'take_profit': float(s['停利'])})
+                            st.session_state.port[tk]['q'] += qty
+                            st.session_state.port[tk]['c'] += total_cost
+                            st.session_state.writer.set_balance(st.session_state.bal)
+                            st.session_state.writer.set_position(tk, st.session_state.port[tk])
+                            st.session_state.writer.commit()
+                            st.success("交易成功！"); st.rerun()
+                        else: st.error("餘額不足")
 
-        if st.button("🔄 刷新即時損益金額"):
-            st.rerun()
+    if tab2.open:
+        with tab2:
+            total_unrealized_profit = 0
+            col_bal, col_reset = st.columns([3, 1])
+            col_bal.markdown(f"### 💰 帳戶餘額: `${st.session_state.bal:,.0f}`")
+            if col_reset.button("⚠️ 重置 100 萬"):
+                st.session_state.bal = 1000000
+                st.session_state.port = {}
+                st.session_state.monthly = {}
+                st.session_state.writer.reset(1000000)
+                st.session_state.writer.commit()
+                st.rerun()
+
+            quote_service = get_quote_service()
+            if st.button("🔄 刷新即時損益金額"):
+                quote_service.invalidate(list(st.session_state.port.keys()))
+                st.rerun()
+
+            if st.session_state.port:
+                quotes = quote_service.get(list(st.session_state.port.keys()))
+                for tk, d in list(st.session_state.port.items()):
+                    try:
+                        q = quotes[tk]
+                        now_p, live_ma20, live_ma60 = q['close'], q['ma20'], q['ma60']
+                        cost_per_share = d['c'] / (d['q'] * 1000)
+                        profit = (now_p * d['q'] * 1000) - d['c']
+                        profit_rate = (profit / d['c']) * 100
+                        total_unrealized_profit += profit
+                        stock_id = get_universe().code(tk)
+                        # 資料庫載入的持股一定有這兩欄 (可能是 None)，不能靠 get 的預設值
+                        sl_val = d.get('stop_loss')
+                        if sl_val is None: sl_val = max(live_ma20, live_ma60)
+                        tp_val = d.get('take_profit')
+                        if tp_val is None: tp_val = cost_per_share * 1.2
 
-        if st.session_state.port:
-            for tk, d in list(st.session_state.port.items()):
-                try:
-                    ticker_obj = yf.Ticker(tk)
-                    hist = ticker_obj.history(period="65d")
-                    now_p = hist['Close'].iloc[-1]
-                    live_ma20 = hist['Close'].rolling(20).mean().iloc[-1]
-                    live_ma60 = hist['Close'].rolling(60).mean().iloc[-1]
-                    cost_per_share = d['c'] / (d['q'] * 1000)
-                    profit = (now_p * d['q'] * 1000) - d['c']
-                    profit_rate = (profit / d['c']) * 100
-                    total_unrealized_profit += profit
-                    stock_id = tk.split('.')[0]
-                    sl_val = d.get('stop_loss', max(live_ma20, live_ma60))
-                    tp_val = d.get('take_profit', cost_per_share * 1.2)
-
-                    if now_p <= sl_val:
-                        st.error(f"⚠️ 股票代號 \"{stock_id}\" 已低於停損位 {sl_val:.2f}，建議賣出")
+                        if now_p <= sl_val:
+                            st.error(f"⚠️ 股票代號 \"{stock_id}\" 已低於停損位 {sl_val:.2f}，建議賣出")
                     
-                    color = "profit-up" if profit >= 0 else "profit-down"
-                    st.markdown(f"""
-                    <div class='stock-card'>
-                        <h4>{stock_id} ({d['q']} 張)</h4>
-                        <p>損益金額: <span class='{color}'>${profit:,.0f}</span> ({profit_rate:.2f}%)</p>
-                        <p>成本價: {cost_per_share:.2f} | 現價: {now_p:.2f}</p>
-                        <p>📊 即時 20MA: {live_ma20:.2f} | 60MA: {live_ma60:.2f}</p>
-                        <p>🛑 買入停損: {sl_val:.2f} | 🎯 預設停利: {tp_val:.2f}</p>
-                        <a href='https://www.wantgoo.com/stock/{stock_id}' target='_blank'>📈 查看即時線圖</a>
-                    </div>""", unsafe_allow_html=True)
+                        color = "profit-up" if profit >= 0 else "profit-down"
+                        st.markdown(f"""
+                        <div class='stock-card'>
+                            <h4>{stock_id} ({d['q']} 張)</h4>
+                            <p>損益金額: <span class='{color}'>${profit:,.0f}</span> ({profit_rate:.2f}%)</p>
+                            <p>成本價: {cost_per_share:.2f} | 現價: {now_p:.2f}</p>
+                            <p>📊 即時 20MA: {live_ma20:.2f} | 60MA: {live_ma60:.2f}</p>
+                            <p>🛑 買入停損: {sl_val:.2f} | 🎯 預設停利: {tp_val:.2f}</p>
+                            <a href='https://www.wantgoo.com/stock/{stock_id}' target='_blank'>📈 查看即時線圖</a>
+                        </div>""", unsafe_allow_html=True)
                     
-                    with st.expander(f"💸 賣出 {stock_id}"):
-                        s_qty = st.number_input("賣出張數", min_value=0.001, max_value=float(d['q']), value=float(d['q']), step=0.001, key=f"sq_{tk}")
-                        est_back = s_qty * 1000 * now_p
-                        st.markdown(f"**預計入帳金額： `${est_back:,.3f}`**")
-                        if st.button(f"執行賣出 {s_qty} 張", key=f"sbtn_{tk}"):
-                            # --- 修改點：計算已實現獲利 % ---
-                            cost_of_sold = (s_qty / d['q']) * d['c']
-                            realized_p = est_back - cost_of_sold
-                            realized_pct = round((realized_p / cost_of_sold) * 100, 2)
+                        with st.expander(f"💸 賣出 {stock_id}"):
+                            s_qty = st.number_input("賣出張數", min_value=0.001, max_value=float(d['q']), value=float(d['q']), step=0.001, key=f"sq_{tk}")
+                            est_back = s_qty * 1000 * now_p
+                            st.markdown(f"**預計入帳金額： `${est_back:,.3f}`**")
+                            if st.button(f"執行賣出 {s_qty} 張", key=f"sbtn_{tk}"):
+                                # --- 修改點：計算已實現獲利 % ---
+                                cost_of_sold = (s_qty / d['q']) * d['c']
+                                realized_p = est_back - cost_of_sold
+                                realized_pct = round((realized_p / cost_of_sold) * 100, 2)
                             
-                            history_entry = {
-                                "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                                "month": datetime.now().strftime("%Y-%m"),
-                                "stock": stock_id, 
-                                "qty": s_qty, 
-                                "profit": realized_p,
-                                "pct": f"{realized_pct}%"  # 新增百分比欄位
-                            }
-                            st.session_state.history.append(history_entry)
-                            st.session_state.bal += est_back
-                            st.session_state.port[tk]['q'] -= s_qty
-                            st.session_state.port[tk]['c'] -= cost_of_sold
-                            if st.session_state.port[tk]['q'] <= 0.0001: del st.session_state.port[tk]
-                            supabase.table("users").update({
-                                "balance": st.session_state.bal, 
-                                "portfolio": st.session_state.port,
-                                "history": st.session_state.history
-                            }).eq("username", st.session_state.user).execute()
-                            st.success("賣出成功！"); st.rerun()
-                except Exception as e:
-                    st.warning(f"正在更新 {tk} 數據中...")
+                                history_entry = {
+                                    "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                                    "month": datetime.now().strftime("%Y-%m"),
+                                    "stock": stock_id, 
+                                    "qty": s_qty, 
+                                    "profit": realized_p,
+                                    "pct": f"{realized_pct}%"  # 新增百分比欄位
+                                }
+                                month = history_entry['month']
+                                st.session_state.monthly[month] = add_to_month(st.session_state.monthly.get(month), realized_p)
+                                st.session_state.bal += est_back
+                                st.session_state.port[tk]['q'] -= s_qty
+                                st.session_state.port[tk]['c'] -= cost_of_sold
+                                if st.session_state.port[tk]['q'] <= 0.0001: del st.session_state.port[tk]
+                                st.session_state.writer.add_trade(history_entry)
+                                st.session_state.writer.set_balance(st.session_state.bal)
+                                st.session_state.writer.set_position(tk, st.session_state.port.get(tk))
+                                st.session_state.writer.commit()
+                                st.success("賣出成功！"); st.rerun()
+                    except Exception as e:
+                        st.warning(f"正在更新 {tk} 數據中...")
 
-            st.divider()
-            sum_color = "profit-up" if total_unrealized_profit >= 0 else "profit-down"
-            st.markdown(f"### 📈 總未實現損益: <span class='{sum_color}'>${total_unrealized_profit:,.0f}</span>", unsafe_allow_html=True)
-        else:
-            st.info("目前庫存空空如也")
-
-    with tab3:
-        st.markdown("### 📊 已實現損益歷史")
-        if st.session_state.history:
-            df_hist = pd.DataFrame(st.session_state.history)
-            month_list = ["全部"] + sorted(list(df_hist['month'].unique()), reverse=True)
-            sel_month = st.selectbox("📅 篩選月份", month_list)
-            view_df = df_hist if sel_month == "全部" else df_hist[df_hist['month'] == sel_month]
-            total_realized = view_df['profit'].sum()
-            summary_color = "#FF3D00" if total_realized >= 0 else "#00E676"
-            st.markdown(f"#### 💰 該期間總已實現損益: <span style='color:{summary_color}'>${total_realized:,.0f}</span>", unsafe_allow_html=True)
+                st.divider()
+                sum_color = "profit-up" if total_unrealized_profit >= 0 else "profit-down"
+                st.markdown(f"### 📈 總未實現損益: <span class='{sum_color}'>${total_unrealized_profit:,.0f}</span>", unsafe_allow_html=True)
+            else:
+                st.info("目前庫存空空如也")
+
+    if tab3.open:
+        with tab3:
+            import pandas as pd
+            st.markdown("### 📊 已實現損益歷史")
+            monthly = st.session_state.monthly
+            if monthly:
+                month_list = ["全部"] + sorted(monthly.keys(), reverse=True)
+                sel_month = st.selectbox("📅 篩選月份", month_list)
+                picked = list(monthly.values()) if sel_month == "全部" else [monthly[sel_month]]
+                total_realized = sum(m['realized'] for m in picked)
+                n_trades = sum(m['trades'] for m in picked)
+                win_rate = sum(m['wins'] for m in picked) / n_trades * 100 if n_trades else 0
+                summary_color = "#FF3D00" if total_realized >= 0 else "#00E676"
+                st.markdown(f"#### 💰 該期間總已實現損益: <span style='color:{summary_color}'>${total_realized:,.0f}</span> | 🧾 {n_trades} 筆 | 🏆 勝率 {win_rate:.1f}%", unsafe_allow_html=True)
             
-            # --- 修改點：在顯示表格中加入 'pct' 欄位 ---
-            # 判斷 dataframe 是否有 pct 欄位 (舊資料可能沒有)
-            cols_to_show = ['date', 'stock', 'qty', 'profit']
-            if 'pct' in view_df.columns:
-                cols_to_show.append('pct')
+                # 明細一次只讀一頁，不把整段歷史載入 session
+                n_pages = max(1, -(-n_trades // HIST_PAGE_SIZE))
+                page = st.number_input(f"📄 頁數 (共 {n_pages} 頁)", min_value=1, max_value=n_pages, value=1, step=1) - 1
+                view_df = pd.DataFrame(history_page(sel_month, page))
             
-            st.dataframe(view_df[cols_to_show].sort_values('date', ascending=False), use_container_width=True)
-        else:
-            st.info("尚無歷史成交紀錄")
-
-    with tab4:
-        st.markdown("### ⭐ 個人追蹤清單")
-        tickers_map = get_all_tickers()
-        c1, c2 = st.columns([3, 1])
-        with c1:
-            selected_stock = st.selectbox("🔍 搜尋並加入股票代號", options=list(tickers_map.keys()), 
-                                        format_func=lambda x: tickers_map.get(x))
-        with c2:
-            st.write(" ")
-            if st.button("➕ 加入自選"):
-                if 'watchlist' not in st.session_state: st.session_state.watchlist = []
-                if selected_stock not in st.session_state.watchlist:
-                    st.session_state.watchlist.append(selected_stock)
-                    supabase.table("users").update({"watchlist": st.session_state.watchlist}).eq("username", st.session_state.user).execute()
-                    st.rerun()
-                else:
-                    st.toast("已在清單中")
-        st.divider()
-        if st.session_state.get('watchlist'):
-            for wt in st.session_state.watchlist:
-                sid = wt.split('.')[0]
-                sinfo = tickers_map.get(wt, sid)
-                with st.container():
-                    st.markdown(f"""
-                    <div class='stock-card' style='padding: 15px;'>
-                        <div style='display: flex; justify-content: space-between; align-items: center;'>
-                            <div>
-                                <h4 style='margin:0;'>{sinfo}</h4>
-                                <a href='https://www.wantgoo.com/stock/{sid}' target='_blank'>📈 查看線圖</a>
-                            </div>
-                        </div>
-                    </div>""", unsafe_allow_html=True)
-                    if st.button(f"🗑️ 移除 {sid}", key=f"rem_{sid}"):
-                        st.session_state.watchlist.remove(wt)
-                        supabase.table("users").update({"watchlist": st.session_state.watchlist}).eq("username", st.session_state.user).execute()
+                # 判斷 dataframe 是否有 pct 欄位 (舊資料可能沒有)
+                cols_to_show = ['date', 'stock', 'qty', 'profit']
+                if 'pct' in view_df.columns:
+                    cols_to_show.append('pct')
+            
+                if not view_df.empty:
+                    st.dataframe(view_df[cols_to_show], use_container_width=True)
+            else:
+                st.info("尚無歷史成交紀錄")
+
+    if tab4.open:
+        with tab4:
+            st.markdown("### ⭐ 個人追蹤清單")
+            universe = get_universe()
+            # 只把前 SEARCH_LIMIT 筆符合的送到下拉選單，不再每次重跑都傳整份 1800 檔清單
+            q_col, g_col = st.columns([2, 1])
+            query = q_col.text_input("🔍 輸入代號或名稱搜尋 (例: 2330、台積)", key="wl_query")
+            group = g_col.selectbox("🏭 或依產業瀏覽", ["全部"] + sorted(universe.groups), key="wl_group")
+            if query: matches = universe.search(query, SEARCH_LIMIT)
+            elif group != "全部": matches = universe.groups[group][:SEARCH_LIMIT]
+            else: matches = []
+            c1, c2 = st.columns([3, 1])
+            with c1:
+                selected_stock = st.selectbox("📋 搜尋結果", options=matches, format_func=universe.label,
+                                              placeholder="請先輸入關鍵字或選擇產業")
+            with c2:
+                st.write(" ")
+                if st.button("➕ 加入自選", disabled=not matches):
+                    if 'watchlist' not in st.session_state: st.session_state.watchlist = []
+                    if selected_stock not in st.session_state.watchlist:
+                        st.session_state.watchlist.append(selected_stock)
+                        st.session_state.writer.set_watchlist(st.session_state.watchlist); st.session_state.writer.commit()
                         st.rerun()
-        else:
-            st.info("您的自選清單目前是空的")
+                    else:
+                        st.toast("已在清單中")
+            st.divider()
+            if st.session_state.get('watchlist'):
+                # 與背景監控共用報價快取，自選股多半已在快取中
+                wl_quotes = get_quote_service().get(st.session_state.watchlist)
+                for wt in st.session_state.watchlist:
+                    sid = universe.code(wt)
+                    sinfo = universe.label(wt)
+                    q = wl_quotes.get(wt)
+                    if q and q.get('prev_close'):
+                        chg = (q['close'] / q['prev_close'] - 1) * 100
+                        price_html = f"<div style='text-align:right;'><span class='price-tag'>${q['close']:.2f}</span><br><span class='{'profit-up' if chg >= 0 else 'profit-down'}'>{chg:+.2f}%</span></div>"
+                    elif q: price_html = f"<span class='price-tag'>${q['close']:.2f}</span>"
+                    else: price_html = "<span>暫無報價</span>"
+                    with st.container():
+                        st.markdown(f"""
+                        <div class='stock-card' style='padding: 15px;'>
+                            <div style='display: flex; justify-content: space-between; align-items: center;'>
+                                <div>
+                                    <h4 style='margin:0;'>{sinfo}</h4>
+                                    <a href='https://www.wantgoo.com/stock/{sid}' target='_blank'>📈 查看線圖</a>
+                                </div>
+                                {price_html}
+                            </div>
+                        </div>""", unsafe_allow_html=True)
+                        if st.button(f"🗑️ 移除 {sid}", key=f"rem_{sid}"):
+                            st.session_state.watchlist.remove(wt)
+                            st.session_state.writer.set_watchlist(st.session_state.watchlist); st.session_state.writer.commit()
+                            st.rerun()
+            else:
+                st.info("您的自選清單目前是空的")
+
+    if admin_tab and admin_tab[0].open:
+        with admin_tab[0]:
+            import pandas as pd
+            st.markdown("### 🛠️ 掃描量測")
+            m = get_scan_service().metrics()
+            if not m.get("stages"):
+                st.info("尚無掃描量測資料")
+            else:
+                st.caption(f"開始時間: {m['started']} | 觸發: {m.get('reason') or '-'} | 每批中位數 {m['chunk_p50']}s / 最慢 {m['chunk_max']}s")
+                a1, a2 = st.columns(2)
+                with a1:
+                    st.markdown("**各階段耗時 (秒)**")
+                    st.dataframe(pd.Series(m['stages'], name="秒"), use_container_width=True)
+                    st.markdown("**數量**")
+                    st.dataframe(pd.Series(m['counts'], name="檔數"), use_container_width=True)
+                with a2:
+                    st.markdown("**略過原因**")
+                    if m['skips']: st.dataframe(pd.Series(m['skips'], name="檔數"), use_container_width=True)
+                    else: st.caption("無")
+                    st.markdown("**最慢的 10 批下載**")
+                    if m['chunks']: st.dataframe(pd.DataFrame(m['chunks']).sort_values('seconds', ascending=False).head(10), use_container_width=True)
+                if m['failures']:
+                    st.markdown(f"**下載失敗 ({len(m['failures'])} 檔，列出前 50)**")
+                    st.dataframe(pd.Series(dict(list(m['failures'].items())[:50]), name="原因"), use_container_width=True)
+                for e in m['errors']: st.error(f"{e['where']}: {e['error']}")
+            for e in m.get('scheduler_errors', []): st.warning(f"排程: {e}")
+            if m.get('last_outcome') in ("error", "cancelled"):
+                st.caption(f"上次掃描 {m['last_attempt']} 結果 {m['last_outcome']}；排程會在 {get_scan_service().backoff_sec() // 60} 分鐘後才重試")
+            st.markdown("### ⏱️ 啟動計時 (秒)")
+            boot = boot_report()
+            st.caption(f"process 啟動於 {boot['started']}；cold = 此 process 第一次執行，last_run = 上一次重跑")
+            st.dataframe(pd.DataFrame({"cold": boot["cold"], "last_run": boot["last_run"]}), use_container_width=True)
+            st.markdown("### 🔔 停損/停利監控")
+            a_stats = get_alert_service().stats()
+            if a_stats: st.json(a_stats)
+            else: st.caption("監控尚未執行 (只在盤中運作)")
+            st.download_button("⬇️ 下載 metrics.json", json.dumps(m, ensure_ascii=False, indent=1),
+                               file_name="metrics.json", mime="application/json")
 
+# --- 5. 啟動計時報告：冷啟動印一次到 log，管理頁可看冷啟動與最近一次重跑 ---
+mark("page")
+_marks["total"] = round(time.perf_counter() - _T0, 4)
+_boot = boot_report()
+if not _boot["cold"]:
+    _boot["cold"] = dict(_marks)
+    print(f"[startup] {json.dumps(_boot['cold'])}", flush=True)
+_boot["last_run"] = dict(_marks)
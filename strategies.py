@@ -0,0 +1,80 @@
+import os
+import json
+import pandas as pd
+
+# --- 宣告式選股策略：每個策略是一組條件式，條件只能引用已命名的指標 ---
+# 基本指標 (screener.compute_indicators 一次算出)：
+#   bars close prev_close volume ma5 ma10 ma20 ma60 ma60_prev v20_avg w_ma20 day_ret
+# 衍生指標在下方 DERIVED 定義，有用到才計算且只算一次
+DERIVED = {
+    "ma_spread3": lambda ind: (ind[['ma5', 'ma10', 'ma20']].max(axis=1) - ind[['ma5', 'ma10', 'ma20']].min(axis=1)) / ind[['ma5', 'ma10', 'ma20']].min(axis=1),
+    "ma_max4": lambda ind: ind[['ma5', 'ma10', 'ma20', 'ma60']].max(axis=1),
+    "vol_ratio": lambda ind: ind['volume'] / ind['v20_avg'],
+}
+
+STRATEGIES = {
+    "均線糾結突破": {
+        "label": "突破均線糾結強勢策略",
+        "rules": [
+            "bars >= 100",
+            "ma_spread3 <= 0.03",
+            "ma60 > ma60_prev",
+            "close > ma_max4",
+            "close > w_ma20",
+            "volume > v20_avg * 2.0",
+            "day_ret >= 0.025",
+            "volume >= 2000000",
+        ],
+        "stop": "ma20", "target": "close * 1.2",
+    },
+    "爆量長紅": {
+        "label": "單日漲幅 5% 以上且量能放大 3 倍",
+        "rules": ["bars >= 100", "day_ret >= 0.05", "vol_ratio >= 3", "volume >= 1000000"],
+        "stop": "prev_close", "target": "close * 1.15",
+    },
+    "多頭排列": {
+        "label": "5/10/20/60MA 多頭排列且站上週 20MA",
+        "rules": ["bars >= 100", "ma5 > ma10", "ma10 > ma20", "ma20 > ma60", "ma60 > ma60_prev",
+                  "close > w_ma20", "volume >= 1000000"],
+        "stop": "ma20", "target": "close * 1.2",
+    },
+    "季線回測": {
+        "label": "季線上揚且收盤回測季線 2% 以內",
+        "rules": ["bars >= 100", "ma60 > ma60_prev", "close >= ma60", "close <= ma60 * 1.02", "volume >= 1000000"],
+        "stop": "ma60 * 0.97", "target": "close * 1.15",
+    },
+}
+DEFAULT_STRATEGY = "均線糾結突破"
+
+
+def load_strategies():
+    # STRATEGY_FILE 指向 JSON 可覆蓋/新增策略；ACTIVE_STRATEGIES 以逗號指定啟用哪些
+    strategies = dict(STRATEGIES)
+    path = os.environ.get("STRATEGY_FILE")
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as fh: strategies.update(json.load(fh))
+    active = os.environ.get("ACTIVE_STRATEGIES")
+    if active:
+        strategies = {k: v for k, v in strategies.items() if k in active.split(",")}
+    return strategies
+
+
+def with_derived(ind, strategies):
+    # 只補上策略有用到的衍生指標
+    exprs = [r for s in strategies.values() for r in s["rules"] + [s.get("stop", "ma20"), s.get("target", "close")]]
+    ind = ind.copy()
+    for name, fn in DERIVED.items():
+        if any(name in e for e in exprs): ind[name] = fn(ind)
+    return ind
+
+
+def evaluate(ind, strategies):
+    # 同一條件式在多個策略出現也只算一次；回傳 (代碼 x 策略) 的布林表
+    cache, out = {}, {}
+    for name, s in strategies.items():
+        mask = pd.Series(True, index=ind.index)
+        for rule in s["rules"]:
+            if rule not in cache: cache[rule] = ind.eval(rule, engine="python").fillna(False).astype(bool)
+            mask = mask & cache[rule]
+        out[name] = mask
+    return out
@@ -0,0 +1,90 @@
+import numpy as np
+import twstock
+
+# --- 上市櫃代碼索引 (不依賴 Streamlit，背景執行緒/離線工具也能使用) ---
+# 代碼/市場/名稱/產業各存一個陣列，同一位置是同一檔；查詢不再解析顯示字串
+MARKET_DEFAULT_INDUSTRY = {"TW": "上市股", "TWO": "上櫃股"}
+
+
+class Universe:
+    def __init__(self, rows):
+        # rows: [(代碼, 市場後綴, 名稱, 產業), ...]
+        self.codes = np.array([r[0] for r in rows], dtype=str)
+        self.markets = np.array([r[1] for r in rows], dtype=str)
+        self.names = np.array([r[2] for r in rows], dtype=str)
+        self.industries = np.array([r[3] for r in rows], dtype=str)
+        self.tickers = [f"{c}.{m}" for c, m in zip(self.codes, self.markets)]
+        self.pos = {t: i for i, t in enumerate(self.tickers)}
+        self.groups = {}  # 產業 → [代碼...]，依原順序
+        for t, ind in zip(self.tickers, self.industries):
+            self.groups.setdefault(str(ind), []).append(t)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __iter__(self):
+        return iter(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self.pos
+
+    def subset(self, tickers):
+        return Universe([self.row(t) for t in tickers if t in self.pos])
+
+    def row(self, ticker):
+        i = self.pos[ticker]
+        return str(self.codes[i]), str(self.markets[i]), str(self.names[i]), str(self.industries[i])
+
+    def code(self, ticker):
+        # 已下市或不在清單的代碼 (舊持股) 才退回用後綴切
+        i = self.pos.get(ticker)
+        return str(self.codes[i]) if i is not None else ticker.rsplit('.', 1)[0]
+
+    def name(self, ticker):
+        i = self.pos.get(ticker)
+        return str(self.names[i]) if i is not None else ""
+
+    def industry(self, ticker):
+        i = self.pos.get(ticker)
+        return str(self.industries[i]) if i is not None else ""
+
+    def label(self, ticker):
+        i = self.pos.get(ticker)
+        if i is None: return self.code(ticker)
+        return f"{self.codes[i]} {self.names[i]} ({self.industries[i]})"
+
+    def search(self, query, limit=20):
+        # 排序：代碼開頭 > 名稱開頭 > 代碼/名稱包含 > 名稱依序含有每個字 (模糊)；只回傳前 limit 筆
+        q = query.strip()
+        if not q: return []
+        tiers = [
+            np.char.startswith(self.codes, q),
+            np.char.startswith(self.names, q),
+            (np.char.find(self.codes, q) >= 0) | (np.char.find(self.names, q) >= 0),
+        ]
+        out, seen = [], np.zeros(len(self), bool)
+        for hit in tiers:
+            for i in np.flatnonzero(hit & ~seen):
+                out.append(self.tickers[i])
+                if len(out) >= limit: return out
+            seen |= hit
+        for i in np.flatnonzero(~seen):
+            if _subsequence(q, self.names[i]):
+                out.append(self.tickers[i])
+                if len(out) >= limit: break
+        return out
+
+
+def _subsequence(q, s):
+    it = iter(s)
+    return all(ch in it for ch in q)
+
+
+def load_universe():
+    rows = []
+    for market, table in (("TW", twstock.twse), ("TWO", twstock.tpex)):
+        for code, info in table.items():
+            if len(code) == 4:
+                # twstock 的產業欄位叫 group (例如「半導體業」)
+                rows.append((code, market, getattr(info, 'name', ''), getattr(info, 'group', '') or MARKET_DEFAULT_INDUSTRY[market]))
+    return Universe(rows)